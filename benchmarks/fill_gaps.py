@@ -0,0 +1,66 @@
+'''
+Micro-benchmark of gap filling on a full foil array (n_foil_params, n_points_Re, n_points_alfa):
+per-curve np.polyfit loop vs batched fill_gaps_in_xfoil_curves.
+
+Run from repo root: python -m benchmarks.fill_gaps
+'''
+import timeit
+import warnings
+import numpy as np
+from config import *
+from lib.preprocess_modules import fill_gaps_in_xfoil_curves
+
+
+def fill_gaps_per_curve(curve, deg=3):
+    '''
+    Previous per-curve fill_gaps_in_xfoil_curve implementation.
+    '''
+    res_curve = curve.copy()
+    x = np.arange(len(res_curve))
+    has_values = ~np.isnan(res_curve)
+    has_nans = np.isnan(res_curve)
+    try:
+        points = np.polyfit(x[has_values], res_curve[has_values], deg=deg)
+        res_curve[has_nans] = np.polyval(points, x[has_nans])
+    except Exception:
+        pass
+    return res_curve
+
+
+def fill_foil_per_curve(foil_array):
+    foil_array = foil_array.copy()
+    for p in range(4):
+        for r in range(n_points_Re):
+            foil_array[p, r, :] = fill_gaps_per_curve(foil_array[p, r, :])
+        for a in range(n_points_alfa):
+            foil_array[p, :, a] = fill_gaps_per_curve(foil_array[p, :, a])
+    return foil_array
+
+
+def fill_foil_batched(foil_array):
+    foil_array = foil_array.copy()
+    foil_array[:4] = fill_gaps_in_xfoil_curves(foil_array[:4].reshape(-1, n_points_alfa)).reshape(4, n_points_Re, n_points_alfa)
+    curves = foil_array[:4].transpose(0, 2, 1).reshape(-1, n_points_Re)
+    foil_array[:4] = fill_gaps_in_xfoil_curves(curves).reshape(4, n_points_alfa, n_points_Re).transpose(0, 2, 1)
+    return foil_array
+
+
+if __name__ == "__main__":
+
+    # polyfit warns on poorly conditioned curves
+    warnings.simplefilter('ignore')
+
+    rng = np.random.default_rng(42)
+    alfas = np.linspace(alfa_min, alfa_max, n_points_alfa)
+    foil_array = np.zeros((n_foil_params, n_points_Re, n_points_alfa))
+    foil_array[:4] = np.sin(alfas/5)[None, None, :] + np.linspace(0, 1, n_points_Re)[None, :, None] + rng.normal(0, 0.01, (4, n_points_Re, n_points_alfa))
+    foil_array[:4][rng.random((4, n_points_Re, n_points_alfa)) < 0.1] = np.nan
+
+    ref = fill_foil_per_curve(foil_array)
+    res = fill_foil_batched(foil_array)
+    print('Max difference: %.3e' % np.nanmax(np.abs(ref-res)))
+
+    n = 20
+    t_loop = timeit.timeit(lambda: fill_foil_per_curve(foil_array), number=n)/n
+    t_batch = timeit.timeit(lambda: fill_foil_batched(foil_array), number=n)/n
+    print('Per-curve polyfit: %.2f ms, batched: %.2f ms, speed-up x%.1f' % (t_loop*1e3, t_batch*1e3, t_loop/t_batch))
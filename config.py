@@ -3,6 +3,10 @@ dataset_folder                     = "./dataset/256x1024" #"./dataset/512x512"
 foils_dat_path                     = "./Foils DB/dat"
 foils_pkl_path                     = "./Foils DB/pkl"
 foils_bmp_path                     = "./Foils DB/bmp"
+foils_store_path                   = "./Foils DB/store"
+polar_cache_path                   = "./Foils DB/cache"
+alfa_step_cache_file               = "./Foils DB/alfa_step.pkl"
+foils_manifest_file                = "./Foils DB/manifest.pkl"
 weights_path                       = "./weights"
 
 # foil preprocessing params
@@ -17,6 +21,9 @@ re_max                             = 200000
 max_nans_in_curve                  = 0.6
 flap_position                      = 0.7
 xfoil_max_iterations               = 64
+xfoil_early_abort                  = True  # stop foil's sweeps once some alfa point can't get min(4, n_points_Re) Re values for gap filling
+polar_cache_max_size_mb            = 512
+xfoil_n_workers                    = 4     # processes sharing (foil, Re) XFoil units
 foil_exception_list                = ['goe388.pkl' , 'goe451.pkl' , 'eiffel428.pkl' , 'eiffel430.pkl', 'ebambino7.pkl', 'ea81006.pkl',
                                       'goe802a.pkl', 'goe802b.pkl', 'naca63a210.pkl', 'naca63206.pkl', 'rc1064c.pkl'  , 'saratov.pkl',
                                       'ua79sff.pkl']
@@ -24,13 +31,30 @@ foil_exception_list                = ['goe388.pkl' , 'goe451.pkl' , 'eiffel428.p
 # bitmaps generation params
 bitmap_outputs                     = [(256, 1024), (512, 512)]
 zoom_coef                          = 2048./28.45
+bitmap_dpi                         = 72            # dpi of matplotlib figures target bitmaps were drawn with
 n_points_interpolate_for_bmp       = 10000
 
+# synthetic foils params
+synthetic_dat_path                 = "./Foils DB/synthetic/dat"
+synthetic_pkl_path                 = "./Foils DB/synthetic/pkl"
+synthetic_n_cst                    = 8              # A coefs per surface
+synthetic_cst_upper                = (0.05, 0.25)   # range of mean A coef of upper surface
+synthetic_cst_lower                = (-0.15, 0.1)   # range of mean A coef of lower surface
+synthetic_cst_jitter               = 0.04           # std of A coefs around their mean
+synthetic_deform_depth             = 30             # max deform() depth in percents
+synthetic_thickness_range          = (0.04, 0.10)   # root thickness band of foils DB
+synthetic_n_coords                 = 160
+synthetic_chunk_size               = 256            # foils generated, calculated and stored per step
+synthetic_n_cores                  = 2              # core budget: XFoil worker processes
+synthetic_niceness                 = 10             # os.nice increment of XFoil worker processes only, generator keeps its priority
+synthetic_max_stalled_chunks       = 10             # generator gives up after so many chunks in a row without new foils
+
 # training params
 train_percentage                   = 0.75
 val_percentage                     = 0.9
 
 # prediction params
 n_points_in_predicted_dat          = 256
+predicted_contour_smooth_box       = 5     # savgol window of one smoothing pass of sub-pixel contours, 0 to skip
 weights_file                       = 'train v4 bs12 2020-12-31 11-47.h5'
 yellow_threshold                   = 0.25
\ No newline at end of file
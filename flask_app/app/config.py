@@ -3,6 +3,10 @@ dataset_folder                     = "./dataset"
 foils_dat_path                     = "./app/Foils DB/dat"
 foils_pkl_path                     = "./app/Foils DB/pkl"
 foils_bmp_path                     = "./app/Foils DB/bmp"
+foils_store_path                   = "./app/Foils DB/store"
+polar_cache_path                   = "./app/Foils DB/cache"
+alfa_step_cache_file               = "./app/Foils DB/alfa_step.pkl"
+foils_manifest_file                = "./app/Foils DB/manifest.pkl"
 weights_path                       = "./app/weights"
 
 # foil preprocessing params
@@ -17,6 +21,9 @@ re_max                             = 200000
 max_nans_in_curve                  = 0.6
 flap_position                      = 0.7
 xfoil_max_iterations               = 64
+xfoil_early_abort                  = True  # stop foil's sweeps once some alfa point can't get min(4, n_points_Re) Re values for gap filling
+polar_cache_max_size_mb            = 512
+xfoil_n_workers                    = 1     # app runs XFoil serially in request and job threads, no process pools
 foil_exception_list                = ['goe388.pkl' , 'goe451.pkl' , 'eiffel428.pkl' , 'eiffel430.pkl', 'ebambino7.pkl', 'ea81006.pkl',
                                       'goe802a.pkl', 'goe802b.pkl', 'naca63a210.pkl', 'naca63206.pkl', 'rc1064c.pkl'  , 'saratov.pkl',
                                       'ua79sff.pkl']
@@ -24,6 +31,7 @@ foil_exception_list                = ['goe388.pkl' , 'goe451.pkl' , 'eiffel428.p
 # bitmaps generation params
 bitmap_outputs                     = [(256, 1024), (512, 512)]
 zoom_coef                          = 2048./28.45
+bitmap_dpi                         = 72            # dpi of matplotlib figures target bitmaps were drawn with
 n_points_interpolate_for_bmp       = 10000
 
 # training params
@@ -32,10 +40,21 @@ val_percentage                     = 0.9
 
 # prediction params
 n_points_in_predicted_dat          = 256
+predicted_contour_smooth_box       = 5     # savgol window of one smoothing pass of sub-pixel contours, 0 to skip
 # weights_file                       = 'Final weights for 512x512 with Tversky loss and BS=16 2021-03-25 12-40.h5'
 weights_file                       = 'Final weights for 256x1024 with Tversky loss and BS=16 2021-05-06 12-55.h5'
 yellow_threshold                   = 0.25
 
 # Flask app params
 files_folder                       = './app/files'
-xls_folder                         = './files'
\ No newline at end of file
+xls_folder                         = './files'
+inference_max_batch                = 16    # samples in one batched forward pass of concurrent requests
+inference_max_wait_ms              = 5     # time to collect concurrent requests into a batch
+jobs_max_workers                   = 2     # pipelines (XFoil, prediction) running at once in background jobs
+jobs_max_queued                    = 32    # waiting jobs, new submits are rejected above
+jobs_keep_time_s                   = 3600  # finished jobs status is kept for polling
+workspaces_folder                  = './app/files/workspaces'  # per-request scratch folders, tmpfs path keeps them in memory
+workspaces_ttl_s                   = 3600  # workspaces older than this are removed
+prediction_cache_path              = './app/prediction_cache'  # predict() outputs keyed by input, weights, contour and XFoil settings
+prediction_cache_max_size_mb       = 256
+prediction_cache_max_age_s         = 2592000  # 30 days since last hit, every hit restarts it
\ No newline at end of file
@@ -2,18 +2,28 @@ import pandas as pd
 from app.config import *
 from app.lib.utils import *
 from app.lib.preprocess_modules import *
+from app.lib.polar_store import PolarStore
+from app.jobs import sweep_progress
 from pathlib import Path
 import flask
 import os
 import sys
 import time
 
-def get_foil_array(fname):
+# consolidated foils DB
+polar_store = PolarStore(foils_store_path)
+
+def get_foil_array(fname, progress=None, folder=files_folder, coords=None):
     
-    ''' Seeks requested foil in database and in cwd. If foil pkl array exists, uses it, else calculates foil params.
+    ''' Calculates foil params for uploaded foil. Foil with the same name and coords is taken from foils DB store,
+    polars of already analysed geometry are taken from polars cache, whatever the file name is, else calculated with XFoil.
+    Uploads only go to polars cache, foils DB store is read-only for requests.
     Saves result as xls file.
     
     fname: Foil .dat file name.
+    progress: optional callback(stage, fraction) of background job.
+    folder: workspace folder of the request, xlsx is saved there.
+    coords: raw foil coords (x, y) parsed from uploaded file, .dat file in *folder* is read if None.
     
     '''
 
@@ -21,20 +31,7 @@ def get_foil_array(fname):
     
     print('Search for %s params...' % fname)
         
-    dat_path = files_folder
-        
-    print('Search ready foil pkl data for %s in files folder...' % fname)
-    if fname.replace('.dat', '.pkl') not in os.listdir(files_folder):
-        print('Search ready foil pkl data for %s in %s...' % (fname, foils_pkl_path))
-        if  fname.replace('.dat', '.pkl') in os.listdir(foils_pkl_path):
-            pkl_path = foils_pkl_path
-        else:
-            pkl_path = None
-    else:
-        pkl_path=files_folder
-    
-    if pkl_path:
-        print('Found %s at %s.' % (fname.replace('.dat', '.pkl'), pkl_path))
+    dat_path = folder
     
     # get list of alfas and alfa step
     alfa_step, alfas = get_alfa_step(alfa_min, alfa_max, n_points_alfa)
@@ -45,21 +42,21 @@ def get_foil_array(fname):
     print("Alfas:", alfas)
     print("Re's:", Re)
     
-    if pkl_path:        
-        print('Use found foil data array from', Path(pkl_path, fname.replace('.dat', '.pkl')))
-        foil_array = load_pkl(Path(pkl_path, fname.replace('.dat', '.pkl')))                                      
-    else:                     
-        print('Generate new foil data array...')        
-        foil_array = create_foil_array_from_dat_file(Path(dat_path, fname), Re, alfas, alfa_min, alfa_max, alfa_step)        
-        if dat_path == './':
-            save_pkl(foil_array, fname.replace('.dat', '.pkl'))
-            print('Foil data array saved as %s in current folder' % fname.replace('.dat', '.pkl'))
-        else:
-            save_pkl(foil_array, Path(foils_pkl_path, fname.replace('.dat', '.pkl')))
-            print('Foil data array saved as %s ' % Path(foils_pkl_path, fname.replace('.dat', '.pkl')))              
+    if progress: progress('reading')
+    name = fname.replace('.dat', '')
+    x_raw, y_raw = coords if coords is not None else read_airfoil_dat_file(Path(dat_path, fname))
+
+    if name in polar_store and np.array_equal(polar_store.get_coords(name), (x_raw, y_raw)):
+        print('Use foil data array from', foils_store_path)
+        foil_array = polar_store.get(name)
+    else:
+        # cached by geometry hash inside, XFoil runs serially in request thread
+        foil_array = create_foil_array_from_dat_file(Path(dat_path, fname), Re, alfas, alfa_min, alfa_max, alfa_step,
+                                                     on_sweep=sweep_progress(progress, 'xfoil', len(Re)), coords=(x_raw, y_raw))
             
     assert isinstance(foil_array, dict), 'Foil array is not a dict.'
     
+    if progress: progress('saving')
     foil_array = foil_array['X']
     S = foil_array[5,0,0]
     d = foil_array[4,0,0]
@@ -86,8 +83,8 @@ def get_foil_array(fname):
     fname = fname.replace('.dat', ' loaded.xlsx')
 
     try:
-        print('Saving as', str(Path(files_folder, fname)))
-        db.to_excel(Path(files_folder, fname), sheet_name='loaded', index=False)
+        print('Saving as', str(Path(folder, fname)))
+        db.to_excel(Path(folder, fname), sheet_name='loaded', index=False)
         output['xlsx'] = fname
     except:
         output['server_error'] = print('\n\nFile', fname, 'was not saved, because it opened by user.')
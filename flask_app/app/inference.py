@@ -0,0 +1,66 @@
+from queue import Queue, Empty
+import threading
+import time
+import numpy as np
+from app.config import *
+
+
+
+class InferenceBroker():
+    '''
+    Micro-batching wrapper of Keras model for concurrent requests.
+    Requests put their samples to the queue and wait, single worker thread collects samples for up to
+    *max_wait_ms* or *max_batch* samples and runs one batched forward pass for all of them.
+    Has model's predict(X_batch), so it is passed to predict() instead of the model.
+    '''
+
+    def __init__(self, model, max_batch=inference_max_batch, max_wait_ms=inference_max_wait_ms):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms/1000.
+        self.requests = Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def predict(self, X_batch):
+        '''
+        Returns model predictions for samples X_batch, blocks until the batch with them is calculated.
+        '''
+        request = {'X': np.asarray(X_batch), 'done': threading.Event()}
+        self.requests.put(request)
+        request['done'].wait()
+
+        if 'error' in request: raise request['error']
+        return request['y']
+
+    def _collect(self):
+        '''
+        Waits for the first request and adds requests coming within max_wait until max_batch samples.
+        '''
+        batch = [self.requests.get()]
+        n_samples = len(batch[0]['X'])
+        deadline = time.time()+self.max_wait
+
+        while n_samples < self.max_batch:
+            try:
+                request = self.requests.get(timeout=max(deadline-time.time(), 0))
+            except Empty:
+                break
+            batch.append(request)
+            n_samples += len(request['X'])
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                y = self.model.predict(np.concatenate([r['X'] for r in batch]))
+                # hand every request its own part of predictions
+                start = 0
+                for r in batch:
+                    r['y'] = y[start:start+len(r['X'])]
+                    start += len(r['X'])
+            except Exception as ex:
+                for r in batch: r['error'] = ex
+            for r in batch: r['done'].set()
@@ -0,0 +1,105 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import uuid
+from app.config import *
+
+
+
+class JobManager():
+    '''
+    Background jobs for long requests (XFoil, prediction) in bounded pool of *max_workers* threads.
+    submit() returns job id at once, clients poll status() or follow events() while the job runs.
+    Job function gets progress(stage, fraction=None) callback, its return value is job result.
+    Status of finished jobs is kept for *keep_time_s* seconds.
+    Workspace of a job is held in *workspaces* until the job is finished, so it is not removed by TTL.
+    '''
+
+    def __init__(self, max_workers=jobs_max_workers, max_queued=jobs_max_queued, keep_time_s=jobs_keep_time_s, workspaces=None):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_queued = max_queued
+        self.keep_time = keep_time_s
+        self.workspaces = workspaces
+        self.jobs = {}
+        self.changed = threading.Condition()
+
+    def submit(self, name, fn, *args, workspace=None, **kwargs):
+        '''
+        Queues fn(*args, progress=callback, **kwargs) as job *name* working in *workspace* folder. Returns job id.
+        '''
+        with self.changed:
+            self._forget_old()
+            if sum(job['status']=='queued' for job in self.jobs.values()) >= self.max_queued:
+                raise Exception('Too many queued jobs, try later.')
+
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = {'id': job_id, 'name': name, 'status': 'queued', 'stage': None, 'progress': None,
+                                 'result': None, 'error': None, 'updated': time.time()}
+
+        if self.workspaces is not None and workspace is not None: self.workspaces.hold(workspace)
+        self.pool.submit(self._run, job_id, fn, args, kwargs, workspace)
+        return job_id
+
+    def _update(self, job_id, **fields):
+        with self.changed:
+            self.jobs[job_id].update(fields, updated=time.time())
+            self.changed.notify_all()
+
+    def _run(self, job_id, fn, args, kwargs, workspace):
+        self._update(job_id, status='running')
+
+        def progress(stage, fraction=None):
+            self._update(job_id, stage=stage, progress=fraction)
+
+        try:
+            result = fn(*args, progress=progress, **kwargs)
+            self._update(job_id, status='done', result=result)
+        except Exception as ex:
+            self._update(job_id, status='failed', error=str(ex))
+        finally:
+            if self.workspaces is not None and workspace is not None: self.workspaces.release(workspace)
+
+    def _forget_old(self):
+        for job_id in [j for j, job in self.jobs.items() if job['status'] in ('done', 'failed') and time.time()-job['updated'] > self.keep_time]:
+            del self.jobs[job_id]
+
+    def status(self, job_id):
+        '''
+        Returns copy of job status dict or None for unknown job.
+        '''
+        with self.changed:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def events(self, job_id, timeout=15):
+        '''
+        Yields job status on every change until job is finished, repeats last status every *timeout* seconds.
+        '''
+        last = None
+        while True:
+            with self.changed:
+                job = self.jobs.get(job_id)
+                if job is not None and job['updated']==last:
+                    self.changed.wait(timeout)
+                    job = self.jobs.get(job_id)
+                job = dict(job) if job is not None else None
+
+            if job is None: return
+            last = job['updated']
+            yield job
+            if job['status'] in ('done', 'failed'): return
+
+
+
+def sweep_progress(progress, stage, n_sweeps):
+    '''
+    Returns on_sweep callback for XFoil runs reporting share of finished sweeps as *stage* progress, None without progress.
+    '''
+    if progress is None: return None
+
+    n_done = [0]
+    def on_sweep(foil_idx, re_idx):
+        n_done[0] += 1
+        progress(stage, n_done[0]/n_sweeps)
+
+    return on_sweep
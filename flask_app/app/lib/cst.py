@@ -0,0 +1,71 @@
+from functools import lru_cache
+from math import factorial
+import numpy as np
+
+
+
+def cst_basis(x, N, N1=0.5, N2=1.0):
+    '''
+    Returns (len(x), N) matrix of CST terms: class function x**N1*(1-x)**N2 times Bernstein polynomials
+    C(N, i)*x**i*(1-x)**(N-i), i = 0...N-1, so surface z = cst_basis(x, N) @ A + x*dz.
+    '''
+    x = np.asarray(x, dtype='float64')[:, None]
+    i = np.arange(N)
+    binom = np.array([factorial(N)/(factorial(k)*factorial(N-k)) for k in range(N)])
+    return (x**N1)*((1-x)**N2)*binom*(x**i)*((1-x)**(N-i))
+
+
+
+@lru_cache(maxsize=32)
+def get_cst_x(n_coords):
+    '''
+    Returns read-only cosine spaced x coords of lower (1...0) and upper (0...1) surfaces for *n_coords* points.
+    '''
+    x = 0.5*(np.cos(2*np.pi/n_coords*np.arange(n_coords))+1)
+    zeroind = np.argmin(x)
+
+    xl = np.hstack([x[:zeroind], np.array([0])])
+    xu = np.hstack([x[zeroind:], np.array([1])])
+    xl.setflags(write=False); xu.setflags(write=False)
+    return xl, xu
+
+
+
+@lru_cache(maxsize=32)
+def get_cst_bases(Nl, Nu, n_coords, N1=0.5, N2=1.0):
+    '''
+    Returns read-only CST basis matrices of lower and upper surfaces on get_cst_x grids, cached per configuration.
+    '''
+    xl, xu = get_cst_x(n_coords)
+    Bl, Bu = cst_basis(xl, Nl, N1, N2), cst_basis(xu, Nu, N1, N2)
+    Bl.setflags(write=False); Bu.setflags(write=False)
+    return Bl, Bu
+
+
+
+def get_airfoils_coords(Au, Al, N1=0.5, N2=1.0, n_coords=100, dz=0.):
+    '''
+    Batched get_airfoil_coords: generates foils of all rows of A coefs with one matrix multiply per surface.
+    -----------
+    Inputs:
+    Au, Al         # Numpy arrays (n_foils, Nu) and (n_foils, Nl) of A coeffs
+    N1 = 0.5       # nose form
+    N2 = 1         # nose form
+    n_coords = 100 # quantity of x absolute coords
+    dz = 0.        # trailing edge thickness, scalar or array (n_foils,)
+    -----------
+    Outputs:
+    x[n_coords+2]  # Numpy array with x coords shared by all foils
+    z[n_foils, n_coords+2] # Numpy array with z coords of foils
+    '''
+    Au = np.atleast_2d(np.asarray(Au, dtype='float64'))
+    Al = np.atleast_2d(np.asarray(Al, dtype='float64'))
+    dz = np.asarray(dz, dtype='float64').reshape(-1, 1)
+
+    xl, xu = get_cst_x(n_coords)
+    Bl, Bu = get_cst_bases(Al.shape[1], Au.shape[1], n_coords, N1, N2)
+
+    zl = Al @ Bl.T - xl*dz
+    zu = Au @ Bu.T + xu*dz
+
+    return np.hstack([xl, xu]), np.hstack([zl, zu])
@@ -0,0 +1,149 @@
+from pathlib import Path
+import hashlib
+import os
+import time
+import numpy as np
+from app.config import *
+from app.lib.utils import *
+
+
+# bump to invalidate all cached polars after changes in polar calculation
+POLAR_CACHE_VERSION = 4
+
+
+
+class DiskCache():
+    '''
+    Size-bounded LRU cache of pickled objects, one file per key in *folder*.
+    File modification time is used as last access time, so the cache is shared by
+    all processes working with the same folder (Flask app, offline builder, notebooks).
+    max_age_s: optional bound of time since last access, not since creation: every hit refreshes
+    file modification time, so objects used often never expire, objects not used for longer are dropped.
+    '''
+
+    def __init__(self, folder, max_size_mb=512, suffix='.pkl', max_age_s=None):
+        self.folder = Path(folder)
+        self.max_size = max_size_mb*1024*1024
+        self.suffix = suffix
+        self.max_age = max_age_s
+
+    def path(self, key):
+        return Path(self.folder, key+self.suffix)
+
+    def get(self, key):
+        '''
+        Returns cached object or None if there is no such key.
+        '''
+        fpath = self.path(key)
+        try:
+            if self.max_age is not None and time.time()-os.stat(fpath).st_mtime > self.max_age: return None
+            data = load_pkl(fpath)
+        except Exception:
+            return None
+        try:
+            os.utime(fpath)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        '''
+        Saves object under the key and evicts least recently used files if cache is oversized.
+        '''
+        os.makedirs(self.folder, exist_ok=True)
+        fpath = self.path(key)
+        tmp_path = Path(self.folder, '%s.%i.tmp' % (key, os.getpid()))
+        save_pkl(data, tmp_path)
+        os.replace(tmp_path, fpath)
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes files older than max_age and least recently used files until cache fits in max_size.
+        '''
+        # folder is shared with other processes, files may disappear between scan and stat
+        entries = []
+        for e in os.scandir(self.folder):
+            if not e.name.endswith(self.suffix): continue
+            try:
+                entries.append((e.path, e.stat()))
+            except OSError:
+                pass
+
+        if self.max_age is not None:
+            now = time.time()
+            for path, stat in [(path, stat) for path, stat in entries if now-stat.st_mtime > self.max_age]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                entries.remove((path, stat))
+
+        total = sum(stat.st_size for _, stat in entries)
+        if total <= self.max_size: return
+
+        for path, stat in sorted(entries, key=lambda entry: entry[1].st_mtime):
+            try:
+                os.remove(path)
+                total -= stat.st_size
+            except OSError:
+                pass
+            if total <= self.max_size: break
+
+
+
+def put_to_cache(cache, key, data):
+    '''
+    Puts data to optional *cache* (None - no cache), cache errors are reported and ignored,
+    so computed results are not lost because of shared cache folder.
+    '''
+    if cache is None: return
+    try:
+        cache.put(key, data)
+    except Exception as ex:
+        print('W: Cache write of %s failed: %s' % (key, ex))
+
+
+
+def get_xfoil_settings_hash(Re):
+    '''
+    Returns hash of Re's list and XFoil settings from config which polars depend on.
+    '''
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(Re, dtype='int64').tobytes())
+    h.update(repr((POLAR_CACHE_VERSION, alfa_min, alfa_max, n_points_alfa, xfoil_max_iterations,
+                   max_nans_in_curve, flap_position, n_foil_points)).encode())
+    return h.hexdigest()
+
+
+
+def get_polar_cache_key(foil, Re):
+    '''
+    Returns hash of interpolated foil coords (xfoil Airfoil() object) and XFoil settings from config.
+    Same geometry analysed with same settings gets the same key whatever the file name is.
+    '''
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(foil.x, dtype='float64').tobytes())
+    h.update(np.ascontiguousarray(foil.y, dtype='float64').tobytes())
+    h.update(get_xfoil_settings_hash(Re).encode())
+    return h.hexdigest()
+
+
+
+def get_polar_fail_cache_key(foil, Re, early_abort=xfoil_early_abort):
+    '''
+    Returns key of negative cache: polars cache key plus early abort policy, so rejections
+    made under other policy are not reused.
+    '''
+    h = hashlib.sha1()
+    h.update(get_polar_cache_key(foil, Re).encode())
+    h.update(repr(('fail', early_abort, max_nans_in_curve)).encode())
+    return h.hexdigest()
+
+
+
+# cache shared by /load_foil, predict() and offline builder
+polar_cache = DiskCache(polar_cache_path, polar_cache_max_size_mb)
+
+# negative cache: failure reasons of hopeless foils under get_polar_fail_cache_key keys
+polar_fail_cache = DiskCache(polar_cache_path, polar_cache_max_size_mb, suffix='.fail')
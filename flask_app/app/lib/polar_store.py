@@ -0,0 +1,247 @@
+from pathlib import Path
+from contextlib import contextmanager
+import os
+import threading
+import numpy as np
+from app.config import *
+from app.lib.utils import *
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+
+@contextmanager
+def file_lock(fpath):
+    '''
+    Exclusive lock of *fpath* file shared between processes, file is created if missing.
+    '''
+    with open(fpath, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            # msvcrt locks a byte range from the current position
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+
+class PolarStore():
+    '''
+    Consolidated foils DB in one folder instead of one pickle per foil:
+    - polars.bin: raw float64 block (n_rows, n_foil_params, n_points_Re, n_points_alfa), memory-mapped;
+    - coords.bin: raw float64 block (n_coords_total, 2) of packed x_raw, y_raw of all rows, memory-mapped;
+    - index.pkl: foil names, rows, coords offsets and thicknesses.
+
+    Opening reads only the small index, foil arrays are returned as zero-copy views of the memory maps.
+    Foils are named by .dat/.pkl file name without extension.
+
+    Data files are append-only: overwritten foil gets a new row and the index is switched to it last,
+    so interrupted put leaves the store consistent. Dead rows stay until compact(), which rewrites live rows
+    into files of the next generation (polars.<generation>.bin, coords.<generation>.bin).
+    Writes are serialized between processes with a lock file in the store folder.
+    '''
+
+    def __init__(self, folder=foils_store_path):
+        self.folder = Path(folder)
+        self.lock = threading.Lock()
+        self.shape = (n_foil_params, n_points_Re, n_points_alfa)
+
+        self._load_index()
+        self._map()
+
+    def _load_index(self):
+        try:
+            self.index = load_pkl(Path(self.folder, 'index.pkl'))
+        except FileNotFoundError:
+            self.index = {'shape': self.shape, 'names': [], 'rows': {}, 'coords': [], 'd': [], 'S': [], 'n_coords': 0}
+
+        assert tuple(self.index['shape'])==self.shape, "Store %s has foil arrays of other shape %s" % (self.folder, self.index['shape'])
+
+    def _file(self, kind, generation=None):
+        '''
+        Returns path of *kind* ('polars' or 'coords') data file of *generation*, current one if None.
+        '''
+        if generation is None: generation = self.index.get('generation', 0)
+        return Path(self.folder, kind+'.bin' if generation==0 else '%s.%i.bin' % (kind, generation))
+
+    def _map(self):
+        n = self.n_rows
+        self.X = np.memmap(self._file('polars'), dtype='float64', mode='r', shape=(n, *self.shape)) if n else np.zeros((0, *self.shape))
+        self.coords = np.memmap(self._file('coords'), dtype='float64', mode='r', shape=(self.index['n_coords'], 2)) if n else np.zeros((0, 2))
+
+    def _save_index(self):
+        # index is written last, so interrupted write leaves the store consistent
+        save_pkl(self.index, Path(self.folder, 'index.tmp'))
+        os.replace(Path(self.folder, 'index.tmp'), Path(self.folder, 'index.pkl'))
+
+    def __len__(self):
+        return len(self.index['rows'])
+
+    def __contains__(self, name):
+        return name in self.index['rows']
+
+    @property
+    def names(self):
+        return list(self.index['names'])
+
+    @property
+    def n_rows(self):
+        '''
+        Number of rows in data files, dead rows of overwritten foils included.
+        '''
+        return len(self.index['coords'])
+
+    def get_X(self, name):
+        '''
+        Returns foil array (n_foil_params, n_points_Re, n_points_alfa) as read-only view.
+        '''
+        return self.X[self.index['rows'][name]]
+
+    def get_coords(self, name):
+        '''
+        Returns raw foil coords x, y as read-only views.
+        '''
+        start, length = self.index['coords'][self.index['rows'][name]]
+        xy = self.coords[start:start+length]
+        return xy[:, 0], xy[:, 1]
+
+    def get(self, name):
+        '''
+        Returns foil dict like in foil pkl files: X, x_raw, y_raw, d, S.
+        '''
+        row = self.index['rows'][name]
+        x, y = self.get_coords(name)
+        return {'X': self.X[row], 'x_raw': x, 'y_raw': y, 'd': self.index['d'][row], 'S': self.index['S'][row]}
+
+    def _write_at(self, fpath, offset, data):
+        '''
+        Writes arrays bytes at *offset* of file, dropping tail left by interrupted put.
+        '''
+        with open(fpath, 'r+b' if fpath.exists() else 'wb') as f:
+            f.seek(offset)
+            for a in data: f.write(a.tobytes())
+            f.truncate()
+
+    def put(self, name, foil_output):
+        '''
+        Adds foil from foil output dict (see create_foil_array_from_dat_file) to the store.
+        Existing foil is overwritten by a new row.
+        '''
+        self.put_many([(name, foil_output)])
+
+    def put_many(self, items):
+        '''
+        Adds (name, foil output dict) pairs to the store with one write of data files and index per batch.
+        '''
+        items = list(items)
+        if not items: return
+
+        X = [np.ascontiguousarray(foil_output['X'], dtype='float64') for _, foil_output in items]
+        assert all(x.shape==self.shape for x in X), "Foil array of wrong shape"
+        xy = [np.ascontiguousarray(np.stack((foil_output['x_raw'], foil_output['y_raw']), axis=1), dtype='float64') for _, foil_output in items]
+
+        os.makedirs(self.folder, exist_ok=True)
+        with self.lock, file_lock(Path(self.folder, 'store.lock')):
+
+            # other processes may have written since the index was read
+            self._load_index()
+
+            row_bytes = int(np.prod(self.shape))*8
+            self._write_at(self._file('polars'), self.n_rows*row_bytes, X)
+            self._write_at(self._file('coords'), self.index['n_coords']*2*8, xy)
+
+            for (name, foil_output), foil_xy in zip(items, xy):
+                if name not in self.index['rows']: self.index['names'].append(name)
+                self.index['rows'][name] = self.n_rows
+                self.index['coords'].append((self.index['n_coords'], len(foil_xy)))
+                self.index['d'].append(foil_output['d'])
+                self.index['S'].append(foil_output['S'])
+                self.index['n_coords'] += len(foil_xy)
+
+            self._save_index()
+            self._map()
+
+    def compact(self, chunk_size=1024):
+        '''
+        Drops dead rows of overwritten foils: live rows are copied by chunks of *chunk_size* foils into data files
+        of the next generation, index is switched to them and old files are removed.
+        Returns number of dropped rows.
+        '''
+        with self.lock, file_lock(Path(self.folder, 'store.lock')):
+
+            self._load_index()
+            self._map()
+            n_dead = self.n_rows-len(self)
+            if not n_dead: return 0
+
+            generation = self.index.get('generation', 0)+1
+            rows = [self.index['rows'][name] for name in self.index['names']]
+            coords = [self.index['coords'][row] for row in rows]
+
+            offsets = np.cumsum([0]+[length for _, length in coords])
+            for fpath in [self._file('polars', generation), self._file('coords', generation)]:
+                if fpath.exists(): os.remove(fpath)
+
+            for i in range(0, len(rows), chunk_size):
+                chunk = rows[i:i+chunk_size]
+                self._write_at(self._file('polars', generation), i*int(np.prod(self.shape))*8, [self.X[chunk]])
+                self._write_at(self._file('coords', generation), offsets[i]*2*8, [self.coords[start:start+length] for start, length in coords[i:i+chunk_size]])
+
+            old_files = [self._file('polars'), self._file('coords')]
+            self.index = {'shape': self.shape, 'generation': generation, 'names': self.index['names'],
+                          'rows': {name: row for row, name in enumerate(self.index['names'])},
+                          'coords': [(int(offsets[row]), length) for row, (_, length) in enumerate(coords)],
+                          'd': [self.index['d'][row] for row in rows], 'S': [self.index['S'][row] for row in rows],
+                          'n_coords': int(offsets[-1])}
+            self._save_index()
+            self._map()
+
+            # readers of the old index keep their maps, files of open maps can't be removed on Windows
+            for fpath in old_files:
+                try:
+                    os.remove(fpath)
+                except OSError:
+                    pass
+
+            return n_dead
+
+
+
+def convert_pkl_to_store(pkl_path=foils_pkl_path, store_path=foils_store_path, chunk_size=256):
+    '''
+    Converts foil pkl files from *pkl_path* into PolarStore in *store_path*, *chunk_size* foils per write.
+    Returns the store.
+    '''
+    store = PolarStore(store_path)
+
+    fnames = [fname for fname in sorted(os.listdir(pkl_path)) if fname.endswith('.pkl')]
+    for i in range(0, len(fnames), chunk_size):
+        store.put_many((fname[:-len('.pkl')], load_pkl(Path(pkl_path, fname))) for fname in fnames[i:i+chunk_size])
+
+    print('%i foils in %s.' % (len(store), store_path))
+
+    return store
+
+
+
+if __name__ == "__main__":
+
+    # usage: python -m lib.polar_store
+    convert_pkl_to_store()
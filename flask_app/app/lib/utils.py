@@ -6,6 +6,8 @@ import glob
 import gc
 from math import *
 import pickle
+from app.lib.raster import rasterize_foil
+from app.lib.cst import cst_basis, get_airfoils_coords
 
 def f(x):
     '''
@@ -32,17 +34,8 @@ def calc_coef(x, N, N1, N2, A, dz):
     z[len(x)]      # Numpy array with surface z coords
     '''
     
-    z = np.zeros_like(x)
     
-    for zc in range(len(z)):
-        summa=0
-        
-        for i in range(N):
-            summa += A[i]*(f(N)/(f(i)*f(N-i)))*(x[zc]**i)*((1-x[zc])**(N-i))        
-            
-        z[zc] = (x[zc]**N1)*((1-x[zc])**N2)*summa+x[zc]*dz
-        
-    return z
+    return cst_basis(x, N, N1, N2) @ np.asarray(A[:N], dtype='float64') + x*dz
 
 def get_airfoil_coords(Au, Al, N1=0.5, N2=1.0, n_coords=100, dz=0.):
     '''
@@ -57,30 +50,13 @@ def get_airfoil_coords(Au, Al, N1=0.5, N2=1.0, n_coords=100, dz=0.):
     -----------
     Outputs:
     x[n_coords], z[n_coords] - Numpy arrays with foil coords
-    '''
-    
-    Nu = len(Au)
-    Nl = len(Al)
     
-    # Create x coordinate
-    x=np.ones((n_coords))   
-    zeta=np.zeros((n_coords));
-    for i in range(1, n_coords+1):
-        zeta[i-1]=2*pi/n_coords*(i-1);
-        x[i-1]=0.5*(cos(zeta[i-1])+1);
-    zeroind = np.argmin(x)
-    
-    xl= np.hstack([x[:zeroind],np.array([0])]) 
-    xu = np.hstack([x[zeroind:],np.array([1])]) 
-    x = np.hstack([xl,xu])
-
-    
-    zu = calc_coef(xu, Nu, N1, N2, Au, dz)
-    zl = calc_coef(xl, Nl, N1, N2, Al, -dz)
+    See lib.cst.get_airfoils_coords for batch of foils, basis matrices are cached there.
+    '''
     
-    z = np.hstack([zl,zu])    
+    x, z = get_airfoils_coords(Au, Al, N1, N2, n_coords, dz)
     
-    return x,z
+    return x, z[0]
 
 def array_from_coefs(Au, Al, N1=0.5, N2=1.0, n_coords=100, dz=0.0011111111111111111):
     '''
@@ -98,18 +74,7 @@ def array_from_coefs(Au, Al, N1=0.5, N2=1.0, n_coords=100, dz=0.0011111111111111
     '''
     
     x, z = get_airfoil_coords(Au, Al, N1=0.5, N2=1.0, n_coords=100, dz=0.0011111111111111111)
-    fig = plt.figure(figsize=(7.12,7.12),  frameon=False)
-    canvas = FigureCanvasAgg(fig)
-    ax = fig.add_axes([0.,0.,1.,1.])
-    ax.fill(x,z, 'black')
-    ax.axis('equal');
-    ax.axis('off');
-    s, (width, height) = canvas.print_to_buffer()
-    foil_bmp = np.array(np.frombuffer(s, np.uint8).reshape((height, width, 4))[:,:,0])
-    plt.close()
-    foil_bmp[foil_bmp==0] = 1
-    foil_bmp[foil_bmp==255] = 0
-    foil_bmp = foil_bmp.astype('bool') 
+    foil_bmp = rasterize_foil(x, z, 512, 512, fig_size=(7.12, 7.12))
     return foil_bmp
 
 def deform(spline, span_position=80, width=10, depth=10, positive=True):
@@ -2,9 +2,13 @@ import numpy as np
 import pandas as pd
 from pathlib import Path
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure, figaspect
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import time
 import os
 import sys
+import zipfile
+import hashlib
 
 from datetime import datetime
 
@@ -14,29 +18,23 @@ from xfoil.model import Airfoil
 from app.lib.utils import load_pkl, save_pkl
 from app.lib.preprocess_modules import *
 from app.lib.predict_modules import *
+from app.lib.polar_cache import get_xfoil_settings_hash
+from app.jobs import sweep_progress
 from app.config import *
 
 from app.nets.nn import *
 
-def predict(fname, model):
-    ''' Predicts foil.
-    Inputs: xls sheet with foil params with *fname*.
-    Outputs: .dat and /xls files.
-    '''    
-    # dict for output file names
-    output={}
-
-    # load foil data from table
-    df = pd.read_excel(os.path.join(files_folder, fname))
-    # return(os.path.join('./app', xls_folder, fname))
-    
+def read_foil_table(df):
+    ''' Reads desired foil from xls sheet.
+    Inputs: DataFrame of xls sheet with foil params.
+    Outputs: foil array (6, n_points_Re, n_points_alfa), list of Re's, list of alfas.
+    '''
     # get foil params
     Re = df.Re.unique().tolist()
     alfas = df.columns[4:].tolist()
     S = df.iloc[0,2]
     d = df.iloc[0,3]
     
-    print('What in "%s"?\n' % fname)
     print("Available Re's:", Re)
     print("Available alfas:", alfas)
     print("Required S:", S)
@@ -52,53 +50,12 @@ def predict(fname, model):
     foil_array[6,:,:] = (np.array((Re))*np.ones((32,16))).T
     foil_array[7,:,:] = (np.array((alfas))*np.ones((16,32)))
     
-    foil_array = foil_array[:6,...]
-    
-    X = foil_array.reshape(foil_array.shape[0]*foil_array.shape[1]*foil_array.shape[2])
-    re_dict = dict(zip(Re, range(len(Re))))
-    
-    # predict
-    y = (model.predict(X[None,:]))[0, :, :, 0]
-    
-    # round plot
-    y[y>=yellow_threshold]=1
-    y[y<yellow_threshold]=0
-    
-    plt.figure(figsize=(16,16))
-    plt.matshow(y,0)
-    plt.savefig(Path(os.getcwd(), files_folder, fname.replace(' desired.xls', ' predicted.png')))
-    output['png'] = str(fname.replace(' desired.xls', ' predicted.png'))
-    
-    print("\nSomething predicted, yellow pixels:", np.sum(y))
-
-    if np.sum(y)==0: return  
-       
-    # smooth foil, get its coordinates
-    f_x, f_y = get_foil_xy_from_picture(y)
+    return foil_array[:6,...], Re, alfas
 
-    # save foil as .dat file
-    df = pd.DataFrame(np.array((f_x, f_y)).T, columns=[fname.replace('desired.xls', 'predicted at'), str(datetime.now())[:19]],dtype='float32')
-    savename = fname.replace('desired.xls', 'predicted.dat')
-    df.to_csv(os.path.join('./app', xls_folder, savename), index=None, sep=' ')
-    output['dat'] = savename
-    
-    # now calculate foil with XFoil and save foil data as xls file
-    
-    # get alfa step
-    alfa_step, _ = get_alfa_step(alfa_min, alfa_max, n_points_alfa)
 
-    print("Alfas:", alfas)
-    print("Re's:", Re)
-
-    print('Generate new foil data array...')        
-    foil_array = create_foil_array_from_dat_file(Path(files_folder, savename), Re, alfas, alfa_min, alfa_max, alfa_step) 
-    
-    assert isinstance(foil_array, dict), 'Foil array is not a dict.'
-
-    save_pkl(foil_array, Path(foils_pkl_path, savename.replace('.dat', '.pkl')))
-    print('Foil data array saved as %s ' % Path(foils_pkl_path, savename.replace('.dat', '.pkl')))            
-
-    foil_array = foil_array['X']
+def get_foil_table(foil_array, Re, alfas):
+    ''' Returns DataFrame of xls table with XFoil polars of foil array (n_foil_params, n_points_Re, n_points_alfa).
+    '''
     S = foil_array[5,0,0]
     d = foil_array[4,0,0]
 
@@ -120,19 +77,232 @@ def predict(fname, model):
             db.iloc[abs_idx, 3]=d
             db.iloc[abs_idx, 4:]=foil_array[layer, re_num, :]            
             abs_idx+=1
+
+    return db
+
+
+def save_predicted_foil(p, name, folder=files_folder):
+    ''' Saves predicted bitmap thresholded by yellow_threshold as png and sub-pixel foil contour
+    of probabilities at yellow_threshold as .dat file.
+    Inputs: network output probability map, foil name, workspace folder to save files.
+    Outputs: dict with png and dat file names, no dat if bitmap is empty, and coords x, y as saved in .dat file or None.
+    '''
+    output = {}
+
+    # round plot
+    y = (p>=yellow_threshold).astype(p.dtype)
+
+    # same picture as plt.matshow, own figure is safe in concurrent requests
+    fig = Figure(figsize=figaspect(y))
+    FigureCanvasAgg(fig)
+    fig.add_axes([0.15, 0.09, 0.775, 0.775]).matshow(y)
+    fig.savefig(Path(folder, name+' predicted.png'))
+    output['png'] = name+' predicted.png'
+    
+    print("\nSomething predicted, yellow pixels:", np.sum(y))
+
+    if np.sum(y)==0: return output, None
+       
+    # smooth foil, get its coordinates
+    f_x, f_y = get_foil_xy_from_probability_map(p, yellow_threshold)
+
+    # save foil as .dat file
+    df = pd.DataFrame(np.array((f_x, f_y)).T, columns=[name+' predicted at', str(datetime.now())[:19]],dtype='float32')
+    savename = name+' predicted.dat'
+    text = df.to_csv(index=None, sep=' ')
+    Path(folder, savename).write_text(text)
+    output['dat'] = savename
+
+    # coords parsed from the same text as .dat file, so XFoil validation gets the saved foil without reading it back
+    return output, parse_airfoil_dat(text, savename)
+
+
+def get_prediction_cache_key(X, Re, alfas, weights_id):
+    ''' Returns hash of desired foil array with its Re's and alfas, model weights identity, yellow_threshold and contour smoothing,
+    XFoil settings of validation (alfa grid, iterations, gap filling, POLAR_CACHE_VERSION) and early abort policy.
+    '''
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(X, dtype='float64').tobytes())
+    h.update(repr((list(Re), list(alfas), weights_id, yellow_threshold, predicted_contour_smooth_box,
+                   get_xfoil_settings_hash(Re), xfoil_early_abort)).encode())
+    return h.hexdigest()
+
+
+def cache_prediction(cache, key, output, folder):
+    ''' Puts png, dat and xlsx files of predict() output from *folder* into prediction cache.
+    '''
+    cache.put(key, {ext: Path(folder, output[ext]).read_bytes() for ext in ['png', 'dat', 'xlsx'] if ext in output})
+
+
+def restore_prediction(cached, name, folder):
+    ''' Writes cached files of foil *name* to *folder*. Returns output dict like in predict().
+    '''
+    output = {}
+    for ext, data in cached.items():
+        output[ext] = name+' predicted.'+ext
+        Path(folder, output[ext]).write_bytes(data)
+    return output
+
+
+def validate_predicted_foil(savename, Re, alfas, progress=None, folder=files_folder, cache=None, key=None, coords=None):
+    ''' Calculates predicted foil with XFoil and saves foil data as pkl and xlsx files in workspace *folder*.
+    Inputs: predicted .dat file name in workspace *folder*, Re's and alfas of desired foil, optional progress callback,
+    optional prediction cache and key to put complete prediction to, predicted coords x, y (.dat file is read if None).
+    Outputs: dict with xlsx file name.
+    '''
+    # get alfa step
+    alfa_step, _ = get_alfa_step(alfa_min, alfa_max, n_points_alfa)
+
+    print("Alfas:", alfas)
+    print("Re's:", Re)
+
+    print('Generate new foil data array...')        
+    foil_array = create_foil_array_from_dat_file(Path(folder, savename), Re, alfas, alfa_min, alfa_max, alfa_step,
+                                                 on_sweep=sweep_progress(progress, 'xfoil', len(Re)), coords=coords)
+    
+    assert isinstance(foil_array, dict), 'Foil array is not a dict.'
+
+    save_pkl(foil_array, Path(folder, savename.replace('.dat', '.pkl')))
+    print('Foil data array saved as %s ' % Path(folder, savename.replace('.dat', '.pkl')))
+
+    if progress: progress('saving')
+    db = get_foil_table(foil_array['X'], Re, alfas)
     try:
         print('Saving as', savename.replace('.dat', '.xlsx'))
-        db.to_excel(os.path.join('./app', xls_folder, savename.replace('.dat', '.xlsx')), sheet_name='predicted', index=False)
+        db.to_excel(Path(folder, savename.replace('.dat', '.xlsx')), sheet_name='predicted', index=False)
+        if cache is not None:
+            cache_prediction(cache, key, {'png': savename.replace('.dat', '.png'), 'dat': savename, 'xlsx': savename.replace('.dat', '.xlsx')}, folder)
     except:
         print('\n\nFile',savename.replace('.dat', '.xlsx'),'was not saved, because it opened by user.')
 
     print('\n\nReady, file saved as:', savename.replace('.dat', '.xlsx'))
 
-    output['xlsx'] = str(savename.replace('.dat', '.xlsx'))
+    return {'xlsx': str(savename.replace('.dat', '.xlsx'))}
+
+
+def predict(fname, model, progress=None, jobs=None, folder=files_folder, file=None, cache=None, weights_id=None):
+    ''' Predicts foil.
+    Inputs: xls sheet with foil params with *fname*, optional progress(stage, fraction) callback of background job.
+    jobs: JobManager to run XFoil validation in background, predict returns .dat and png at once
+    with 'validation_job' id, xlsx file is ready when the job is done. Validation runs inline if None.
+    folder: workspace folder of the request, all output files are saved there.
+    file: file-like object with uploaded xls, xls *fname* in *folder* is read if None.
+    cache: DiskCache of outputs keyed by input, Re's, alfas, *weights_id* of the model and yellow_threshold.
+    Repeated input gets cached files at once, only XFoil validation missing in cache is run.
+    Outputs: .dat and /xls files.
+    '''    
+    if progress: progress('reading')
+    # load foil data from table
+    df = pd.read_excel(file if file is not None else Path(folder, fname))
+    
+    print('What in "%s"?\n' % fname)
+    foil_array, Re, alfas = read_foil_table(df)
+    
+    X = foil_array.reshape(foil_array.shape[0]*foil_array.shape[1]*foil_array.shape[2])
+    name = fname.replace(' desired.xls', '')
+
+    key = get_prediction_cache_key(X, Re, alfas, weights_id) if cache is not None else None
+    cached = cache.get(key) if cache is not None else None
+
+    if cached is not None:
+        print('Prediction found in cache.')
+        output, coords = restore_prediction(cached, name, folder), None
+    else:
+        # predict
+        if progress: progress('predicting')
+        y = (model.predict(X[None,:]))[0, :, :, 0]
+        
+        # dict for output file names
+        if progress: progress('contour')
+        output, coords = save_predicted_foil(y, name, folder)
+        if cache is not None: cache_prediction(cache, key, output, folder)
+
+    if 'dat' not in output: return
+    if 'xlsx' in output: return output
+    
+    # now calculate foil with XFoil and save foil data as xls file
+    if jobs is not None:
+        output['validation_job'] = jobs.submit('validate', validate_predicted_foil, output['dat'], Re, alfas, folder=folder, cache=cache, key=key, coords=coords, workspace=folder)
+    else:
+        output.update(validate_predicted_foil(output['dat'], Re, alfas, progress, folder, cache, key, coords))
 
     return output
 
 
+def predict_batch(X, names, model, folder=files_folder):
+    ''' Predicts many foils at once: one batched network pass, predicted foils validated one by one
+    with one XFoil instance. XFoil runs serially in the app, no process pool is started from request threads.
+    Inputs: desired foil arrays X (N, 6, n_points_Re, n_points_alfa) on Re's and alfas of foils DB, N foil names.
+    Outputs: files in workspace *folder*, dict {name: output dict like in predict()}, error message under 'error' for failed foils.
+    '''
+    assert len(X)==len(names), 'Number of foil arrays and names differ.'
+
+    # Re's and alfas of XFoil validation
+    alfa_step, alfas = get_alfa_step(alfa_min, alfa_max, n_points_alfa)
+    Re = np.linspace(re_min, re_max, n_points_Re).astype(int)
+
+    # predict all foils in one pass
+    y = model.predict(np.asarray(X, dtype='float64').reshape(len(X), -1))[..., 0]
+
+    outputs, coords = {}, {}
+    for name, y_foil in zip(names, y):
+        outputs[name], coords[name] = save_predicted_foil(y_foil, name, folder)
+        if 'dat' not in outputs[name]: outputs[name]['error'] = 'Nothing predicted.'
+
+    # XFoil validation of predicted foils
+    xf = XFoil()
+    for name in names:
+        output = outputs[name]
+        if 'dat' not in output: continue
+        try:
+            foil_array = create_foil_array_from_dat_file(Path(folder, output['dat']), Re, alfas, alfa_min, alfa_max, alfa_step, xf=xf, coords=coords[name])
+        except Exception as ex:
+            output['error'] = str(ex)
+            continue
+
+        save_pkl(foil_array, Path(folder, output['dat'].replace('.dat', '.pkl')))
+        xlsx_name = output['dat'].replace('.dat', '.xlsx')
+        get_foil_table(foil_array['X'], Re, alfas).to_excel(Path(folder, xlsx_name), sheet_name='predicted', index=False)
+        output['xlsx'] = xlsx_name
+
+    return outputs
+
+
+def predict_file_batch(fname, model, folder=files_folder, file=None):
+    ''' Predicts foils from one file in workspace *folder* (or file-like *file* of upload) and packs all results into zip archive there.
+    Inputs: *fname* - xls workbook with desired foil table on every sheet (sheet name is foil name)
+    or npz with desired foil arrays 'X' (N, 6, n_points_Re, n_points_alfa) and optional foil 'names'.
+    Outputs: dict with zip file name and errors of failed foils.
+    '''
+    if fname.endswith('.npz'):
+        data = np.load(file if file is not None else Path(folder, fname))
+        X = data['X']
+        names = [str(n) for n in data['names']] if 'names' in data else ['%s %i' % (fname.replace('.npz', ''), i) for i in range(len(X))]
+    else:
+        sheets = pd.read_excel(file if file is not None else Path(folder, fname), sheet_name=None)
+        names, X = [], []
+        for sheet, df in sheets.items():
+            foil_array, Re, _ = read_foil_table(df)
+            assert np.array_equal(Re, np.linspace(re_min, re_max, n_points_Re).astype(int)), "Sheet %s has other Re's than foils DB." % sheet
+            names.append(sheet.replace(' desired', ''))
+            X.append(foil_array)
+        X = np.array(X)
+
+    assert X.shape[1:]==(6, n_points_Re, n_points_alfa), 'Foil arrays of wrong shape %s' % str(X.shape[1:])
+
+    outputs = predict_batch(X, names, model, folder=folder)
+
+    zip_name = fname.rsplit('.', 1)[0]+' predicted.zip'
+    with zipfile.ZipFile(Path(folder, zip_name), 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, output in outputs.items():
+            for key in ['dat', 'xlsx']:
+                if key in output: zf.write(Path(folder, output[key]), output[key])
+        errors = {name: output['error'] for name, output in outputs.items() if 'error' in output}
+        if errors: zf.writestr('errors.txt', ''.join('%s --> %s\n' % (name, error) for name, error in errors.items()))
+
+    return {'zip': zip_name, 'errors': errors}
+
+
 if __name__ == "__main__":
     fname=sys.argv[1]
     predict(fname)
\ No newline at end of file
@@ -1,27 +1,61 @@
 from app import app
 import os
-from flask import request, send_file, abort
+from flask import request, send_file, abort, jsonify, Response
+import json
+import io
 from app.config import *
 from pathlib import Path
 from app.dat_to_xls import get_foil_array
-from app.predict import predict
+from app.predict import predict, predict_file_batch
 from app.nets.nn import nn_2561024
+from app.inference import InferenceBroker
+from app.jobs import JobManager
+from app.workspace import Workspaces
+from app.lib.preprocess_modules import get_alfa_step, parse_airfoil_dat
+from app.lib.polar_cache import DiskCache
+from app.lib.polar_builder import get_file_hash
 
 app.config['SEND_FILE_MAX_AGE_DEFAULT']=0
 app.config["CACHE_TYPE"] = "null"
 
-def cleanup(del_list):
-     for f in os.listdir(files_folder):
-        for d in del_list:
-            if d in f:
-                try:
-                    os.remove(os.path.join(files_folder,f))
-                except:
-                    pass
+# every request works in its own folder, old ones are removed by TTL
+workspaces = Workspaces(workspaces_folder, workspaces_ttl_s)
+
+def read_upload(extensions):
+    ''' Returns name and contents (BytesIO) of uploaded file, aborts if there is no file or its type is not allowed.
+    '''
+    if 'file' not in request.files: abort(405, description='POST: No file in request.')
+
+    file = request.files['file']
+
+    if not any(e in file.filename for e in extensions): abort(405, description='POST: File type not allowed.')
+
+    return file.filename, io.BytesIO(file.read())
+
+def parse_upload_dat(fname, data):
+    ''' Returns raw coords x, y of uploaded .dat file.
+    '''
+    x, y = parse_airfoil_dat(data.getvalue().decode('latin-1'), fname)
+    assert len(x)>0, 'E: No coordinates in %s' % fname
+    return x, y
 
 # define model
 model = nn_2561024(verbose=True)
 model.load_weights(str(Path('./app/weights', weights_file)))
+
+# repeated predict inputs are served from cache of outputs, weights file hash tells models apart
+prediction_cache = DiskCache(prediction_cache_path, prediction_cache_max_size_mb, max_age_s=prediction_cache_max_age_s)
+weights_id = get_file_hash(Path('./app/weights', weights_file))
+
+# concurrent requests share batched forward passes
+model = InferenceBroker(model, inference_max_batch, inference_max_wait_ms)
+
+# background jobs for long XFoil and predict pipelines
+jobs = JobManager(jobs_max_workers, jobs_max_queued, jobs_keep_time_s, workspaces)
+
+# calculate or load alfa step once, requests take it from memory
+alfa_step, alfas = get_alfa_step(alfa_min, alfa_max, n_points_alfa)
+print('Alfa step: %f' % alfa_step)
     
 
 @app.route('/')
@@ -35,55 +69,100 @@ def idx():
 @app.route('/load_foil', methods=['POST']) # to check: curl -F "file=@e387 predicted.dat" http://localhost:5000/load_foil --output myfile.xlsx
 def process_loaded_foil():
     
-    if 'file' not in request.files: abort(405, description='POST: No file in request.')
+    fname, data = read_upload(['.dat'])
+    ws_id, folder = workspaces.create()
 
-    # cleanup old files
-    cleanup(['.dat', 'loaded.xls'])
+    try:
+        output = get_foil_array(fname, folder=folder, coords=parse_upload_dat(fname, data))
+    except Exception as ex:
+        abort(500, description=str(ex))
 
-    file = request.files['file']
-
-    if '.dat' in file.filename:
-        try:
-            file.save(os.path.join(files_folder, file.filename))            
-            return get_foil_array(file.filename)            
-        except Exception as ex:
-            abort(500, description=str(ex))
-    else:
-        abort(405, description='POST: File type not allowed.')
+    output['workspace'] = ws_id
+    return output
 
     
 @app.route('/predict_foil', methods=['POST']) # to check: curl -F "file=@e387 desired.dat" http://localhost:5000/predict_foil --output myfile.xlsx
 def predict_foil():
      
-    if 'file' not in request.files: abort(405, description='POST: No file in request.')
+    fname, data = read_upload(['.xls'])
+    ws_id, folder = workspaces.create()
 
-    # cleanup old files
-    cleanup(['desired.xls', 'predicted.xls', '.dat', '.png'])
+    # validation=background: return .dat and png at once, xlsx is made by background job
+    background = request.args.get('validation')=='background'
 
-    file = request.files['file']
+    try: 
+        output = predict(fname, model, jobs=jobs if background else None, folder=folder, file=data, cache=prediction_cache, weights_id=weights_id)
+    except Exception as ex:
+        abort(500, description=str(ex))
 
-    if '.xls' in file.filename:                    
-        file.save(os.path.join(files_folder, file.filename))
-        try: 
-            return predict(file.filename, model)     
-        except Exception as ex:
-            abort(500, description=str(ex))
-    else:
-        abort(405, description='POST: File type not allowed.')
+    if output is None: return {'workspace': ws_id}
+    output['workspace'] = ws_id
+    return output
 
-@app.route('/get_predicted_files', methods=['GET', 'POST']) # to check: curl --header "Content-Type: application/json" -d "{\"filename\":\"mh32.xlsx\"}" http://localhost:5000/get_predicted_files --output "qwerty.xlsx"
+@app.route('/predict_batch', methods=['POST']) # to check: curl -F "file=@study desired.xlsx" http://localhost:5000/predict_batch --output study.zip
+def predict_batch_foils():
+     
+    fname, data = read_upload(['.xls', '.npz'])
+    ws_id, folder = workspaces.create()
+
+    try: 
+        output = predict_file_batch(fname, model, folder=folder, file=data)
+    except Exception as ex:
+        abort(500, description=str(ex))
+
+    return send_file(Path(folder, output['zip']), as_attachment=True, cache_timeout=0)
+
+def submit_job(name, fn, extensions):
+    ''' Queues fn(file name, file contents, workspace folder, progress) with uploaded file as background job.
+    Returns JSON with job id and workspace id, job result gets workspace id too.
+    '''
+    fname, data = read_upload(extensions)
+    ws_id, folder = workspaces.create()
+
+    def run(progress):
+        output = fn(fname, data, folder, progress) or {}
+        output['workspace'] = ws_id
+        return output
+
+    try:
+        job_id = jobs.submit(name, run, workspace=folder)
+    except Exception as ex:
+        abort(503, description=str(ex))
+
+    return jsonify({'job_id': job_id, 'workspace': ws_id}), 202
+
+@app.route('/jobs/load_foil', methods=['POST']) # to check: curl -F "file=@e387.dat" http://localhost:5000/jobs/load_foil
+def submit_load_foil():
+    return submit_job('load_foil', lambda fname, data, folder, progress: get_foil_array(fname, progress, folder, parse_upload_dat(fname, data)), ['.dat'])
+
+@app.route('/jobs/predict_foil', methods=['POST']) # to check: curl -F "file=@e387 desired.xls" http://localhost:5000/jobs/predict_foil
+def submit_predict_foil():
+    return submit_job('predict_foil', lambda fname, data, folder, progress: predict(fname, model, progress, folder=folder, file=data, cache=prediction_cache, weights_id=weights_id), ['.xls'])
+
+@app.route('/jobs/<job_id>', methods=['GET']) # to check: curl http://localhost:5000/jobs/<job_id>, files from 'result' are taken by /get_predicted_files
+def job_status(job_id):
+    status = jobs.status(job_id)
+    if status is None: abort(404, description='No job ' + job_id)
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/events', methods=['GET']) # to check: curl -N http://localhost:5000/jobs/<job_id>/events
+def job_events(job_id):
+    if jobs.status(job_id) is None: abort(404, description='No job ' + job_id)
+    stream = ('data: %s\n\n' % json.dumps(status) for status in jobs.events(job_id))
+    return Response(stream, mimetype='text/event-stream')
+
+@app.route('/get_predicted_files', methods=['GET', 'POST']) # to check: curl --header "Content-Type: application/json" -d "{\"filename\":\"mh32.xlsx\", \"workspace\":\"...\"}" http://localhost:5000/get_predicted_files --output "qwerty.xlsx"
 def get_dat():
 
     if request.json:
         fname = request.json['filename']
         try:
+            # without workspace id the newest workspace with such file is taken
+            ws_id = request.json.get('workspace')
+            fpath = workspaces.path(ws_id, fname) if ws_id else workspaces.find(fname)
             print("Sending", fname)            
-            return send_file(Path(xls_folder, fname), as_attachment=True, cache_timeout=0)  
+            return send_file(fpath, as_attachment=True, cache_timeout=0)  
         except:
             abort(404, description=str('No file ' + fname))
     else:
         abort(405, description=str(request.method)+": JSON with ['filename'] required.")
-
-    
-
-    
\ No newline at end of file
@@ -0,0 +1,86 @@
+from pathlib import Path
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from app.config import *
+
+
+
+class Workspaces():
+    '''
+    Per-request scratch folders in *root*, so concurrent requests never touch each other's files.
+    Folders older than *ttl_s* seconds (by last modification) are removed when new one is created,
+    except folders held by queued or running jobs (see hold and release).
+    Point workspaces_folder to tmpfs (e.g. /dev/shm/airfoil) to keep workspaces in memory.
+    '''
+
+    def __init__(self, root=workspaces_folder, ttl_s=workspaces_ttl_s):
+        self.root = Path(root).resolve()
+        self.ttl = ttl_s
+        self.lock = threading.Lock()
+        self.held = {}
+
+    def create(self):
+        '''
+        Makes new workspace, returns its id and folder.
+        '''
+        self.gc()
+        ws_id = uuid.uuid4().hex
+        folder = Path(self.root, ws_id)
+        os.makedirs(folder)
+        return ws_id, folder
+
+    def hold(self, folder):
+        '''
+        Protects workspace *folder* from removal until release(), holds are counted.
+        '''
+        key = str(Path(folder).resolve())
+        with self.lock:
+            self.held[key] = self.held.get(key, 0)+1
+
+    def release(self, folder):
+        '''
+        Drops one hold of workspace *folder*, its ttl starts from now.
+        '''
+        key = str(Path(folder).resolve())
+        with self.lock:
+            self.held[key] -= 1
+            if not self.held[key]: del self.held[key]
+        try:
+            os.utime(folder)
+        except OSError:
+            pass
+
+    def path(self, ws_id, fname=''):
+        '''
+        Returns path of file *fname* in workspace *ws_id*, raises for bad id or file name.
+        '''
+        if not re.fullmatch('[0-9a-f]{32}', ws_id) or Path(fname).name!=fname:
+            raise Exception('Bad workspace %s or file name %s' % (ws_id, fname))
+        return Path(self.root, ws_id, fname)
+
+    def find(self, fname):
+        '''
+        Returns path of *fname* in the newest workspace having it or None.
+        '''
+        if Path(fname).name!=fname or not self.root.exists(): return None
+        paths = [Path(e.path, fname) for e in os.scandir(self.root) if e.is_dir()]
+        paths = [p for p in paths if p.exists()]
+        return max(paths, key=lambda p: p.stat().st_mtime) if paths else None
+
+    def gc(self):
+        '''
+        Removes workspaces not modified for ttl seconds and not held by jobs.
+        '''
+        if not self.root.exists(): return
+        with self.lock:
+            held = set(self.held)
+        for e in os.scandir(self.root):
+            try:
+                if e.is_dir() and e.path not in held and time.time()-e.stat().st_mtime > self.ttl:
+                    shutil.rmtree(e.path, ignore_errors=True)
+            except OSError:
+                pass
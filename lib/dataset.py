@@ -0,0 +1,130 @@
+from pathlib import Path
+import os
+import numpy as np
+from config import *
+from lib.utils import load_pkl, save_pkl
+from lib.polar_store import PolarStore
+
+
+# layers of foil arrays in order of n_foil_params axis
+foil_layers = ['Cl', 'Cd', 'Cm', 'Cp', 'd', 'S', 'Re', 'alfa']
+
+# layers included in dataset by default
+default_incl_data = {'Cl': True, 'Cd': True, 'Cm': True, 'Cp': True, 'd': True, 'S': True, 'Re': False, 'alfa': False}
+
+
+
+def pack_bitmaps(y):
+    '''
+    Packs bool bitmaps y (n_samples, *ydim) to uint8 array (n_samples, ceil(prod(ydim)/8)), 8 pixels per byte.
+    '''
+    y = np.asarray(y)
+    return np.packbits(y.reshape(len(y), -1).astype('bool'), axis=1)
+
+
+
+def unpack_bitmaps(packed, ydim, dtype='float32', out=None):
+    '''
+    Unpacks uint8 array (n_samples, n_bytes) made by pack_bitmaps back to (n_samples, *ydim) array of *dtype*.
+    out: optional preallocated array to unpack into, returned instead of new one.
+    '''
+    packed = np.asarray(packed)
+    y = np.unpackbits(packed, axis=1, count=int(np.prod(ydim))).reshape(len(packed), *ydim)
+    if out is None: return y.astype(dtype, copy=False)
+    np.copyto(out, y, casting='unsafe')
+    return out
+
+
+
+def save_packed_bitmaps(y, fpath):
+    '''
+    Saves bool bitmaps y (n_samples, *ydim) packed to .npy file.
+    '''
+    np.save(fpath, pack_bitmaps(y))
+
+
+
+def load_packed_bitmaps(fpath):
+    '''
+    Opens packed bitmaps .npy file as read-only memory map, samples are read from disk only when indexed.
+    '''
+    return np.load(fpath, mmap_mode='r')
+
+
+
+def build_dataset(dataset_path=dataset_folder, bitmap_output=bitmap_outputs[0], incl_data=default_incl_data, store=None, bmp_path=foils_bmp_path, exceptions=foil_exception_list):
+    '''
+    Streams foils from PolarStore and *bmp_path* bitmaps folder of *bitmap_output* resolution into preallocated
+    memory-mapped files in *dataset_path*, so memory use does not depend on dataset size:
+    - X.npy: float64 (n_samples, n_layers*n_points_Re*n_points_alfa) layers of foil arrays selected by *incl_data*;
+    - y_packed.npy: bitmaps packed by pack_bitmaps;
+    - names.pkl: foil names of samples;
+    - stats.pkl: included layers and their mean, std, min, max over the dataset for normalization.
+
+    exceptions: bitmap file names to skip.
+    Returns number of samples.
+    '''
+    if store is None: store = PolarStore()
+
+    layers = [foil_layers.index(key) for key in incl_data if incl_data[key]]
+    pkl_folder = Path(bmp_path, str(bitmap_output[0])+'x'+str(bitmap_output[1]))
+
+    names = []
+    for fname in sorted(os.listdir(pkl_folder)):
+        if not fname.endswith('.pkl') or fname in exceptions: continue
+        if fname.replace('.pkl', '') not in store:
+            print('%s excluded, no polars in store.' % fname)
+            continue
+        names.append(fname.replace('.pkl', ''))
+
+    print('Total samples: %i, layers in sample: %i.' % (len(names), len(layers)))
+
+    os.makedirs(dataset_path, exist_ok=True)
+    n_bytes = (bitmap_output[0]*bitmap_output[1]+7)//8
+    X = np.lib.format.open_memmap(Path(dataset_path, 'X.npy'), mode='w+', dtype='float64', shape=(len(names), len(layers)*n_points_Re*n_points_alfa))
+    y = np.lib.format.open_memmap(Path(dataset_path, 'y_packed.npy'), mode='w+', dtype='uint8', shape=(len(names), n_bytes))
+
+    # running sums for normalization stats
+    total = np.zeros(len(layers))
+    total_sq = np.zeros(len(layers))
+    x_min = np.full(len(layers), np.inf)
+    x_max = np.full(len(layers), -np.inf)
+
+    for sample, name in enumerate(names):
+        foil_X = store.get_X(name)[layers]
+        assert not np.isnan(foil_X).any(), "NaNs in X of %s" % name
+
+        X[sample] = foil_X.reshape(-1)
+        y[sample] = pack_bitmaps(load_pkl(Path(pkl_folder, name+'.pkl'))[None])[0]
+
+        total += foil_X.sum(axis=(1, 2))
+        total_sq += (foil_X**2).sum(axis=(1, 2))
+        x_min = np.minimum(x_min, foil_X.min(axis=(1, 2)))
+        x_max = np.maximum(x_max, foil_X.max(axis=(1, 2)))
+
+    X.flush(); y.flush()
+    del X, y
+
+    n_values = max(len(names), 1)*n_points_Re*n_points_alfa
+    mean = total/n_values
+    stats = {'layers': [foil_layers[i] for i in layers],
+             'mean': mean,
+             'std': np.sqrt(np.maximum(total_sq/n_values-mean**2, 0)),
+             'min': x_min,
+             'max': x_max}
+
+    save_pkl(names, Path(dataset_path, 'names.pkl'))
+    save_pkl(stats, Path(dataset_path, 'stats.pkl'))
+
+    return len(names)
+
+
+
+def load_dataset(dataset_path=dataset_folder):
+    '''
+    Opens dataset made by build_dataset without reading it to memory.
+    Returns X and packed y as read-only memory maps, list of foil names and normalization stats.
+    '''
+    X = np.load(Path(dataset_path, 'X.npy'), mmap_mode='r')
+    y = load_packed_bitmaps(Path(dataset_path, 'y_packed.npy'))
+    return X, y, load_pkl(Path(dataset_path, 'names.pkl')), load_pkl(Path(dataset_path, 'stats.pkl'))
@@ -1,21 +1,48 @@
 import tensorflow.keras.backend as K
 from tensorflow.keras.utils import Sequence
 import numpy as np
+import threading
+from lib.dataset import unpack_bitmaps
 
 class BatchGenerator(Sequence):
+    '''
+    Keras batches of X_input, y_input samples from list_IDs.
+    packed_y: y_input is uint8 array of bitmaps packed by lib.dataset.pack_bitmaps (may be memory-mapped),
+    only samples of current batch are unpacked to dtype_y.
+    prefetch: number of batches prepared ahead in background thread in order of the epoch, 0 - no prefetching.
+    Prefetching assumes in-order access (fit with shuffle=False, shuffling of samples is done by this class):
+    out-of-order batches are gathered synchronously, prefetched batches are kept until requested.
+    queue_size: max_queue_size of fit_generator. Batches are gathered into rings of preallocated buffers,
+    which have to be longer than all batches held at once by Keras queue. Prefetched batches have their own ring,
+    slots of batches waiting in prefetch are never reused, so out-of-order access can't overwrite them.
+    '''
     
-    def __init__(self, X_input, y_input, list_IDs, batch_size=4, Xdim=(64,64,1), ydim=(128,), shuffle=True, dtype_x='float64', dtype_y='float64'):
+    def __init__(self, X_input, y_input, list_IDs, batch_size=4, Xdim=(64,64,1), ydim=(128,), shuffle=True, dtype_x='float64', dtype_y='float64', packed_y=False, prefetch=0, queue_size=10):
         
         self.Xdim = Xdim
         self.ydim = ydim
         self.batch_size = batch_size        
-        self.list_IDs = list_IDs
+        self.list_IDs = np.asarray(list_IDs)
         self.shuffle = shuffle
-        self.on_epoch_end()
         self.X_input = X_input
         self.y_input = y_input
         self.dtype_x = dtype_x
         self.dtype_y = dtype_y
+        self.packed_y = packed_y
+        self.prefetch = prefetch
+
+        # rings of batch buffers reused instead of allocation per batch: synchronous gathers and prefetch
+        self.X_ring = np.empty((queue_size+2, batch_size, *Xdim), dtype = dtype_x)
+        self.y_ring = np.empty((queue_size+2, batch_size, *ydim), dtype = dtype_y)
+        self.ring_pos = 0
+        n_prefetch_buffers = queue_size+prefetch+2 if prefetch else 0
+        self.X_prefetch = np.empty((n_prefetch_buffers, batch_size, *Xdim), dtype = dtype_x)
+        self.y_prefetch = np.empty((n_prefetch_buffers, batch_size, *ydim), dtype = dtype_y)
+        self.prefetch_pos = 0
+        self.lock = threading.Condition()
+        self.prefetch_thread = None
+
+        self.on_epoch_end()
 
     def __len__(self):
         'Denotes the number of batches per epoch'
@@ -23,16 +50,25 @@ class BatchGenerator(Sequence):
 
     def __getitem__(self, index):
 
-        # Generate indexes of the batch
-        indexes = self.indexes[index*self.batch_size:(index+1)*self.batch_size]
+        # take prefetched batch or wait for batch being prepared now
+        if self.prefetch:
+            with self.lock:
+                while index not in self.ready and self.in_work==index:
+                    self.lock.wait()
+                if index in self.ready:
+                    _, batch = self.ready.pop(index)
+                    self.lock.notify_all()
+                    return batch
 
-        # Find list of IDs
-        list_IDs_temp = [self.list_IDs[k] for k in indexes]
+        with self.lock:
+            slot = self.ring_pos
+            self.ring_pos = (self.ring_pos+1) % len(self.X_ring)
 
-        # Generate data
-        X, y = self.__data_generation(list_IDs_temp)
+        return self.__data_generation(self.__batch_IDs(index), self.X_ring[slot], self.y_ring[slot])
 
-        return X, y
+    def __batch_IDs(self, index):
+        'Finds list of IDs of the batch'
+        return self.list_IDs[self.indexes[index*self.batch_size:(index+1)*self.batch_size]]
 
     def on_epoch_end(self):
         'Updates indexes after each epoch'
@@ -40,17 +76,68 @@ class BatchGenerator(Sequence):
         if self.shuffle == True:
             np.random.shuffle(self.indexes)
 
-    def __data_generation(self, list_IDs_temp):
-        'Generates data containing batch_size samples' # X : (n_samples, *dim, n_channels)
-       
-        X = np.empty((self.batch_size, *self.Xdim), dtype = self.dtype_x)
-        y = np.empty((self.batch_size, *self.ydim), dtype = self.dtype_y)
-        
-        for i, ID in enumerate(list_IDs_temp):            
-            X[i,] = self.X_input[ID,]
-            y[i,] = self.y_input[ID,]
+        if self.prefetch:
+            self.__start_prefetch()
+
+    def __start_prefetch(self):
+        'Restarts background thread preparing batches of new epoch'
+        if self.prefetch_thread is not None:
+            self.prefetch_stop.set()
+            with self.lock:
+                self.lock.notify_all()
+            self.prefetch_thread.join()
+
+        self.ready = {}
+        self.in_work = None
+        self.prefetch_stop = threading.Event()
+        self.prefetch_thread = threading.Thread(target=self.__prefetch_worker, args=(self.prefetch_stop,), daemon=True)
+        self.prefetch_thread.start()
+
+    def __prefetch_worker(self, stop):
+        'Prepares batches in order of the epoch keeping at most prefetch batches ready'
+        for index in range(len(self)):
+            with self.lock:
+                while len(self.ready) >= self.prefetch and not stop.is_set():
+                    self.lock.wait()
+                if stop.is_set(): return
+                self.in_work = index
+                slot = self.__prefetch_slot()
+
+            batch = self.__data_generation(self.__batch_IDs(index), self.X_prefetch[slot], self.y_prefetch[slot])
+
+            with self.lock:
+                self.ready[index] = (slot, batch)
+                self.in_work = None
+                self.lock.notify_all()
+
+    def __prefetch_slot(self):
+        'Takes next slot of prefetch ring skipping slots of batches waiting in ready, called under lock'
+        held = {slot for slot, _ in self.ready.values()}
+        while self.prefetch_pos in held:
+            self.prefetch_pos = (self.prefetch_pos+1) % len(self.X_prefetch)
+        slot = self.prefetch_pos
+        self.prefetch_pos = (self.prefetch_pos+1) % len(self.X_prefetch)
+        return slot
+
+    def __data_generation(self, list_IDs_temp, X, y):
+        'Generates data containing batch_size samples into X, y buffers' # X : (n_samples, *dim, n_channels)
+
+        # one fancy-index gather per array
+        self.__gather(self.X_input, list_IDs_temp, X)
+
+        if self.packed_y:
+            unpack_bitmaps(self.y_input[list_IDs_temp], self.ydim, out=y)
+        else:
+            self.__gather(self.y_input, list_IDs_temp, y)
 
         return X, y
+
+    def __gather(self, data, list_IDs_temp, out):
+        'Copies samples list_IDs_temp of data to out'
+        if data.dtype==out.dtype:
+            np.take(data, list_IDs_temp, axis=0, out=out)
+        else:
+            out[...] = data[list_IDs_temp]
     
     
 def tversky_loss(y_true, y_pred):
@@ -0,0 +1,253 @@
+from pathlib import Path
+from multiprocessing import Array, cpu_count
+import argparse
+import hashlib
+import os
+import time
+import numpy as np
+from config import *
+from lib.utils import *
+from lib.preprocess_modules import *
+from lib.xfoil_pool import sweep_units
+from lib.polar_store import PolarStore
+from lib.polar_cache import polar_cache, polar_fail_cache, put_to_cache, get_polar_cache_key, get_polar_fail_cache_key, get_xfoil_settings_hash
+
+
+def build_foil_polars(dat_paths, n_workers=None, pkl_path=foils_pkl_path, overwrite=False, cache=polar_cache, fail_cache=polar_fail_cache, early_abort=xfoil_early_abort, on_result=None, store=None, store_batch=64, niceness=0):
+    '''
+    Calculates polars for list of .dat files *dat_paths* in a pool of *n_workers* processes.
+    Work is split into (foil, Re) units scheduled with work stealing, so one badly converging
+    foil does not hold a worker. Every finished foil is saved to *pkl_path* as soon as all its Re's are ready.
+
+    n_workers: number of worker processes, all cores if None.
+    overwrite: recalculate foils which already have pkl file in *pkl_path*.
+    cache: polars cache keyed by foil geometry, cached foils are saved without XFoil run.
+    fail_cache: negative cache of hopeless foils under *early_abort* policy, such foils are skipped without XFoil run.
+    early_abort: cancel foil's remaining units as soon as get_foil_abort_reason finds it hopeless.
+    on_result: optional callback(dat file name, error message or None) called for every finished foil.
+    store: optional PolarStore to put finished foils into besides pkl files, *store_batch* foils per write.
+    niceness: priority decrease of worker processes, the calling process keeps its priority.
+
+    Returns dict {dat file name: error message} of failed foils.
+    '''
+
+    if n_workers is None: n_workers = cpu_count()
+    assert n_workers>0, "n_workers shall be positive"
+
+    # get list of alfas and alfa step once for all workers
+    alfa_step, alfas = get_alfa_step(alfa_min, alfa_max, n_points_alfa)
+
+    # set list of Re's
+    Re = np.linspace(re_min, re_max, n_points_Re).astype(int)
+
+    # skip ready foils with single directory scan
+    ready = set(os.listdir(pkl_path)) if not overwrite else set()
+    dat_paths = [Path(p) for p in dat_paths if Path(p).name.replace('.dat', '.pkl') not in ready]
+
+    # finished foils are put into the store by batches
+    to_store = []
+
+    def store_foil(fname, foil_output, flush=False):
+        if store is None: return
+        if fname is not None: to_store.append((fname.replace('.dat', ''), foil_output))
+        if to_store and (flush or len(to_store)>=store_batch):
+            store.put_many(to_store)
+            to_store.clear()
+
+    # read foils geometry in main process
+    failed = {}
+    names, geometries, keys, fail_keys = [], [], [], []
+    for fpath in dat_paths:
+        try:
+            geometry = prepare_foil_geometry(fpath)
+        except Exception as ex:
+            failed[fpath.name] = str(ex)
+            if on_result: on_result(fpath.name, str(ex))
+            continue
+
+        key = get_polar_cache_key(geometry['y'], Re)
+        foil_output = cache.get(key) if cache is not None else None
+        if foil_output is not None:
+            foil_output['x_raw'], foil_output['y_raw'] = geometry['x_raw'], geometry['y_raw']
+            save_pkl(foil_output, Path(pkl_path, fpath.name.replace('.dat', '.pkl')))
+            store_foil(fpath.name, foil_output)
+            print('%s --> Polars found in cache, file saved.' % fpath.name)
+            if on_result: on_result(fpath.name, None)
+            continue
+
+        fail_key = get_polar_fail_cache_key(geometry['y'], Re, early_abort)
+        reason = fail_cache.get(fail_key) if fail_cache is not None else None
+        if reason is not None:
+            failed[fpath.name] = reason
+            print('%s --> %s (cached)' % (fpath.name, reason))
+            if on_result: on_result(fpath.name, reason)
+            continue
+
+        names.append(fpath.name)
+        geometries.append(geometry)
+        keys.append(key)
+        fail_keys.append(fail_key)
+
+    print('%i foils (%i units) to calculate with %i workers.' % (len(names), len(names)*len(Re), n_workers))
+
+    start = time.time()
+    done = 0
+    cancelled = Array('b', len(names))
+
+    def save_failure(foil_idx, reason):
+        failed[names[foil_idx]] = reason
+        print('%i/%i %s --> %s' % (done, len(names), names[foil_idx], reason))
+        if on_result: on_result(names[foil_idx], reason)
+
+    units = sweep_units([g['y'] for g in geometries], Re, alfa_min, alfa_max, alfa_step, n_workers, cancelled=cancelled, niceness=niceness)
+    try:
+        for foil_idx, sweeps in collect_foil_sweeps(units, len(names), len(Re), cancelled, early_abort):
+
+            fname = names[foil_idx]
+            done += 1
+            try:
+                if isinstance(sweeps, HopelessFoilError): raise sweeps
+                foil_output = assemble_foil_output(geometries[foil_idx], sweeps, Re, alfas)
+            except HopelessFoilError as ex:
+                save_failure(foil_idx, str(ex))
+                put_to_cache(fail_cache, fail_keys[foil_idx], str(ex))
+                continue
+            except Exception as ex:
+                save_failure(foil_idx, str(ex))
+                continue
+
+            # cache is optional, its errors do not fail computed foil
+            put_to_cache(cache, keys[foil_idx], foil_output)
+
+            try:
+                pkl_name = fname.replace('.dat', '.pkl')
+                save_pkl(foil_output, Path(pkl_path, pkl_name))
+                store_foil(fname, foil_output)
+                print('%i/%i %s --> File %s saved.' % (done, len(names), fname, pkl_name))
+                if on_result: on_result(fname, None)
+            except Exception as ex:
+                save_failure(foil_idx, str(ex))
+    finally:
+        store_foil(None, None, flush=True)
+
+    print('Done in %.1f s, %i foils failed.' % (time.time()-start, len(failed)))
+
+    return failed
+
+
+
+def get_file_hash(fpath):
+    '''
+    Returns sha1 of file contents.
+    '''
+    with open(fpath, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+
+def build_foil_db(dat_path=foils_dat_path, pkl_path=foils_pkl_path, use_list=None, n_workers=None, manifest_file=foils_manifest_file, store=None):
+    '''
+    Incremental, resumable build of foils DB on top of build_foil_polars.
+    Manifest keeps .dat file stat and hash, XFoil settings hash and outcome of every foil, so only new foils
+    and foils whose .dat file or XFoil settings changed are calculated. Manifest is checkpointed while
+    the build runs, interrupted build continues from the last checkpoint.
+
+    use_list: names of .dat files in *dat_path* to build, all .dat files if None.
+    store: optional PolarStore to put built foils into.
+
+    Returns dict {dat file name: error message} of failed foils.
+    '''
+
+    Re = np.linspace(re_min, re_max, n_points_Re).astype(int)
+    settings = get_xfoil_settings_hash(Re)
+
+    try:
+        manifest = load_pkl(manifest_file)
+    except Exception:
+        manifest = {}
+
+    use_list = set(use_list) if use_list is not None else None
+    ready = set(os.listdir(pkl_path))
+    to_build = {}
+    current = {}
+    n_scanned = 0
+
+    # single directory scan, file is hashed only if its stat changed
+    for entry in os.scandir(dat_path):
+        fname = entry.name
+        if not fname.endswith('.dat') or (use_list is not None and fname not in use_list): continue
+
+        n_scanned += 1
+        stat = entry.stat()
+        record = manifest.get(fname)
+        if record: current[fname] = record
+
+        if record and record['settings']==settings and (record['status']!='ok' or fname.replace('.dat', '.pkl') in ready):
+            if record['size']==stat.st_size and record['mtime_ns']==stat.st_mtime_ns: continue
+            dat_hash = get_file_hash(entry.path)
+            if record['dat_hash']==dat_hash:
+                record['size'], record['mtime_ns'] = stat.st_size, stat.st_mtime_ns
+                continue
+        else:
+            dat_hash = get_file_hash(entry.path)
+
+        to_build[fname] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'dat_hash': dat_hash, 'settings': settings}
+
+    # forget removed foils
+    manifest = current
+    print('%i foils up to date, %i to build.' % (n_scanned-len(to_build), len(to_build)))
+
+    last_save = [time.time()]
+
+    def save_manifest():
+        tmp_file = str(manifest_file)+'.tmp'
+        save_pkl(manifest, tmp_file)
+        os.replace(tmp_file, manifest_file)
+        last_save[0] = time.time()
+
+    def checkpoint(fname, error):
+        record = to_build[fname]
+        record['status'] = 'ok' if error is None else 'failed'
+        record['reason'] = error
+        manifest[fname] = record
+        if time.time()-last_save[0] > 1: save_manifest()
+
+    failed = {}
+    try:
+        if to_build:
+            failed = build_foil_polars([Path(dat_path, f) for f in to_build], n_workers, pkl_path=pkl_path, overwrite=True, on_result=checkpoint, store=store)
+    finally:
+        save_manifest()
+
+    return failed
+
+
+
+if __name__ == "__main__":
+
+    # usage: python -m lib.polar_builder --workers 8 --use-list "Foils 4-10 thickness.pkl" [--incremental]
+
+    parser = argparse.ArgumentParser(description='Calculate foils polars with XFoil in parallel.')
+    parser.add_argument('dat_files', nargs='*', help='.dat files to calculate, all files from foils_dat_path if empty')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes, all cores by default')
+    parser.add_argument('--use-list', default=None, help='pkl list of foils names in foils_dat_path to calculate')
+    parser.add_argument('--overwrite', action='store_true', help='recalculate foils with existing pkl files')
+    parser.add_argument('--incremental', action='store_true', help='build foils_dat_path incrementally with manifest, resumes interrupted build')
+    parser.add_argument('--store', action='store_true', help='put built foils into PolarStore in foils_store_path too')
+    args = parser.parse_args()
+
+    store = PolarStore() if args.store else None
+
+    if args.incremental:
+        use_list = load_pkl(Path(foils_dat_path, args.use_list)) if args.use_list else None
+        build_foil_db(use_list=use_list, n_workers=args.workers, store=store)
+
+    else:
+        if args.dat_files:
+            dat_paths = args.dat_files
+        elif args.use_list:
+            dat_paths = [Path(foils_dat_path, f) for f in load_pkl(Path(foils_dat_path, args.use_list))]
+        else:
+            dat_paths = [Path(foils_dat_path, f) for f in os.listdir(foils_dat_path) if f.endswith('.dat')]
+
+        build_foil_polars(dat_paths, args.workers, overwrite=args.overwrite, store=store)
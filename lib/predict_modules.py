@@ -1,4 +1,5 @@
 import numpy as np
+from scipy.signal import savgol_filter
 
 from xfoil import XFoil
 from xfoil.model import Airfoil
@@ -7,12 +8,13 @@ from lib.preprocess_modules import *
 from config import *
 
 
-def prepare_foil_to_predict(fname, n_layers=8):
+def prepare_foil_to_predict(fname, n_layers=8, n_workers=xfoil_n_workers):
     '''
     Generates foil array, lists of Alfa and Re from .dat file with specified *fname* and config data.
     Returns foil_array(n_layers, n_points_Re, n_points_alfa)
     
     n_layers: layers to include [Cy, Cx, Cm, Cp, d, S, Re, Alfa]
+    n_workers: processes to share foil's (foil, Re) XFoil units
     '''
     
     # get list of alfas and alfa step
@@ -23,81 +25,9 @@ def prepare_foil_to_predict(fname, n_layers=8):
    
     print('Prepare %s...' % fname)
 
-    # set up foil data arrays
-    foil_array = np.zeros((n_foil_params, n_points_Re, n_points_alfa))
-    pre_foil_array = np.zeros((n_foil_params, n_points_Re, n_points_alfa))
-
-    # load foil coords from file
-    try:
-        x, y = read_airfoil_dat_file(Path(foils_dat_path, fname))
-    except:
-        raise Exception("W: Foil %s failed to read from file, skipped." % (fname))
-
-    # convert coords to n_foil_points
-    try:
-        x, y = interpolate_airfoil(x, y, n_foil_points)
-    except:
-        raise Exception("W: Foil %s failed to interpolate to %i points, skipped." % (fname, n_foil_points))
-
-
-    # set an Airfoil object on these coords
-    current_foil = Airfoil(x,y)
-
-    # get root and flap thicknesses 
-    try:
-        d = get_foil_flap_thickness(current_foil)
-        S = get_foil_root_thickness(current_foil) 
-    except:
-        raise Exception("W: Foil %s failed to get thicknesses, skipped." % (fname))
-
-    # store in array
-    foil_array[4, :, :] = d
-    foil_array[5, :, :] = S    
-
-    # setup xfoil lib
-    xf = XFoil()
-    xf.airfoil = current_foil
-    xf.max_iter = xfoil_max_iterations
-
-    # xfoiling for each Re
-    for num in range(16):
-
-        xf.Re = Re[num]        
-        a, cl, cd, cm, cp = xf.aseq(alfa_min, alfa_max, alfa_step)  
-
-        assert (len(a)==n_points_alfa), "Lenght of alfa array is wrong!"
-
-        nans_percent = sum(np.isnan(a))/len(a)
-
-        # interpolate gaps in alfa plane
-        if nans_percent < max_nans_in_curve:            
-            cl = fill_gaps_in_xfoil_curve(cl)
-            cd = fill_gaps_in_xfoil_curve(cd)
-            cm = fill_gaps_in_xfoil_curve(cm)
-            cp = fill_gaps_in_xfoil_curve(cp)
-
-        # write results to main array
-        foil_array[0, num, :] = cl
-        foil_array[1, num, :] = cd
-        foil_array[2, num, :] = cm
-        foil_array[3, num, :] = cp
-        foil_array[6, num, :] = Re[num]
-        foil_array[7, num, :] = alfas
-
-        # write results to debug array
-        pre_foil_array[0, num, :] = cl
-        pre_foil_array[1, num, :] = cd
-        pre_foil_array[2, num, :] = cm
-        pre_foil_array[3, num, :] = cp
-        pre_foil_array[6, num, :] = Re[num]
-        pre_foil_array[7, num, :] = alfas
-
-        # interpolate gaps in Re plane
-        for alfa in range(32):
-            foil_array[0, :, alfa] = fill_gaps_in_xfoil_curve(foil_array[0, :, alfa])
-            foil_array[1, :, alfa] = fill_gaps_in_xfoil_curve(foil_array[1, :, alfa])
-            foil_array[2, :, alfa] = fill_gaps_in_xfoil_curve(foil_array[2, :, alfa])
-            foil_array[3, :, alfa] = fill_gaps_in_xfoil_curve(foil_array[3, :, alfa])            
+    # xfoiling for each Re and fill gaps
+    foil_output = create_foil_array_from_dat_file(Path(foils_dat_path, fname), Re, alfas, alfa_min, alfa_max, alfa_step, n_workers=n_workers)
+    foil_array = foil_output['X']
 
     # save or discard data
     assert np.sum(np.isnan(foil_array))==0, "Foil array is empty!"
@@ -121,17 +51,29 @@ def find_first_and_last_1_position(array):
     assert isinstance(array, np.ndarray), 'Image is not Numpy array'
     assert len(array.shape)==1, 'Not an 1D array'
     
-    if np.sum(array)==0: return -1
-    
-    for first in range(len(array)):
-        if array[first]!=0: break
-        
-    for last in range(len(array)-1,0,-1):
-        if array[last]!=0: break
+    has_1, first, last = find_first_and_last_1_positions(array[:, None])
+    if not has_1[0]: return -1
             
-    return first, last    
+    return first[0], last[0]
+
+
+
+def find_first_and_last_1_positions(image):
+    '''
+    Finds first and last non-zero pixels in every column of 2D array at once.
+    Output: tuple of arrays (column has non-zero pixels, first, last) of image.shape[1] length.
+    Last pixel is never less than 1 like in pixel by pixel search.
+    '''
+    mask = image!=0
 
+    # search only rows between the first and the last non-zero ones
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows)==0: return np.zeros(mask.shape[1], dtype='bool'), np.zeros(mask.shape[1], dtype='int'), np.ones(mask.shape[1], dtype='int')
+    mask = mask[rows[0]:rows[-1]+1]
 
+    first = rows[0]+mask.argmax(axis=0)
+    last = np.maximum(rows[-1]-mask[::-1].argmax(axis=0), 1)
+    return mask.any(axis=0), first, last
 
 
 
@@ -156,67 +98,32 @@ def get_foil_xy_from_picture(y):
     assert isinstance(y, np.ndarray), 'Image is not Numpy array'
     assert len(y.shape)==2, 'Image is not binary'
 
+    # верхняя и нижняя границы профиля сразу во всех столбцах
+    has_1, y_top, y_bot = find_first_and_last_1_positions(y)
+    assert has_1.any(), 'Image is empty'
+
     # сначала определим координаты начала и конца оси профиля
+    x_nose = has_1.argmax()
+    x_tail = len(has_1)-1-has_1[::-1].argmax()
 
-    for x_nose in range(y.shape[1]):
-        res = find_first_and_last_1_position(y[:, x_nose])
-        if res!=-1:
-            y_nose_top, y_nose_bot = res
-            break
-
-    for x_tail in range(y.shape[1]-1,0,-1):
-        res = find_first_and_last_1_position(y[:, x_tail])
-        if res!=-1:
-            y_tail_top, y_tail_bot = res
-            break
-
-    if y_nose_top!=y_nose_bot: # ставим точку в середине носика, пригодится для красивой аппроксимации
-        y_nose = int(np.average((y_nose_top, y_nose_bot)))
-        y[y_nose,x_nose-1]=1
+    y_nose = y_top[x_nose]
+    if y_top[x_nose]!=y_bot[x_nose]: # ставим точку в середине носика, пригодится для красивой аппроксимации
+        y_nose = int(np.average((y_top[x_nose], y_bot[x_nose])))
         x_nose-=1
+        has_1[x_nose] = True
+        y_top[x_nose], y_bot[x_nose] = y_nose, max(y_nose, 1)
+
+    has_1, y_top, y_bot = has_1[x_nose:x_tail+1], y_top[x_nose:x_tail+1], y_bot[x_nose:x_tail+1]
+    foil_x = np.arange(len(has_1))
 
-    y=y[:, x_nose:x_tail+1]
-
-    foil_x_top = (np.arange(y.shape[1])).tolist(); foil_x_top.reverse()
-    foil_x_bot = foil_x_top.copy() 
-    foil_y_top=[]
-    foil_y_bot=[]
-
-    # ищем верхнюю и нижнюю границы профиля
-    for x in foil_x_top:
-        if find_first_and_last_1_position(y[:, x])!=-1:
-            y_t, y_b = find_first_and_last_1_position(y[:, x])
-            foil_y_top.append(y_nose - y_t)
-            foil_y_bot.append(y_nose - y_b)
-        else:
-            foil_y_top.append(None)
-            foil_y_bot.append(None)
-
-    # склеиваем верх и низ в списки foil_x_top и foil_н_top
-    foil_x_bot = foil_x_bot[:-1]
-    foil_x_bot.reverse()
-    foil_y_bot = foil_y_bot[:-1]
-    foil_y_bot.reverse()
-    foil_x_top.extend(foil_x_bot)
-    foil_y_top.extend(foil_y_bot)
-
-    foil_x_top = np.array(foil_x_top)
-    foil_y_top = np.array(foil_y_top)
-
-    # итоговые списки с координатами
-    foil_x = []
-    foil_y = []
-
-    # удаляем точки, где дыры в У
-    for i in range(foil_x_top.shape[0]):
-        if foil_y_top[i]!=None:
-            foil_x.append(foil_x_top[i])
-            foil_y.append(foil_y_top[i])
-
-    # превращаем списки в массивы и нормируем к 1
-    foil_x = np.array(foil_x)/(y.shape[1]-1)
-    foil_y = np.array(foil_y)/(y.shape[1]-1)
-    foil_x.shape, foil_y.shape
+    # склеиваем верх (от хвоста к носику) и низ (от носика к хвосту), пропуская пустые столбцы
+    top, bot = has_1[::-1], np.concatenate(([False], has_1[1:]))
+    foil_y = np.concatenate(((y_nose-y_top)[::-1][top], (y_nose-y_bot)[bot]))
+    foil_x = np.concatenate((foil_x[::-1][top], foil_x[bot]))
+
+    # нормируем к 1
+    foil_x = foil_x/(len(has_1)-1)
+    foil_y = foil_y/(len(has_1)-1)
     
     # интерполируем в нужное число точек
     f_x, f_y = interpolate_airfoil(foil_x, foil_y, n_points_in_predicted_dat)
@@ -224,4 +131,119 @@ def get_foil_xy_from_picture(y):
     # сглаживаем
     f_x, f_y = smooth_foil_xy(f_x, f_y)   
     
-    return f_x, f_y
\ No newline at end of file
+    return f_x, f_y
+
+
+def trace_iso_contours(p, level=yellow_threshold):
+    '''
+    Traces iso-lines of 2D float array *p* at *level* by marching squares, crossing points are
+    linearly interpolated on cell edges, so coordinates are sub-pixel.
+    Array is padded with values below level, so all lines are closed. Saddle cells are resolved by cell center value.
+
+    Output: list of closed contours, (n_points, 2) arrays of (row, col) coordinates, first point is not repeated.
+    '''
+    assert isinstance(p, np.ndarray), 'Image is not Numpy array'
+    assert len(p.shape)==2, 'Image is not 2D'
+
+    p = np.pad(p.astype('float64'), 1, constant_values=level-1.)
+    h, w = p.shape
+    above = p>=level
+
+    # edges between (i, j)-(i, j+1) and (i, j)-(i+1, j) are numbered horizontal first
+    id_h = np.arange(h*(w-1)).reshape(h, w-1)
+    id_v = h*(w-1)+np.arange((h-1)*w).reshape(h-1, w)
+
+    # cell corners a b / d c and edges top, right, bottom, left
+    a, b, c, d = above[:-1, :-1], above[:-1, 1:], above[1:, 1:], above[1:, :-1]
+    edges = np.stack((id_h[:-1], id_v[:, 1:], id_h[1:], id_v[:, :-1]), axis=-1)
+    crossed = np.stack((a!=b, b!=c, c!=d, d!=a), axis=-1)
+    n_crossed = crossed.sum(axis=-1)
+
+    # cells with 2 crossed edges have one segment
+    segments = [edges[n_crossed==2][crossed[n_crossed==2]].reshape(-1, 2)]
+
+    # saddles: corners on the diagonal joined through center when it is on their side
+    saddle = n_crossed==4
+    center = (p[:-1, :-1]+p[:-1, 1:]+p[1:, 1:]+p[1:, :-1])[saddle]/4 >= level
+    cut_ac = center!=a[saddle]  # segments cut off corners a and c, otherwise b and d
+    e = edges[saddle]
+    segments.append(np.where(cut_ac[:, None], e[:, [3, 0]], e[:, [0, 1]]))
+    segments.append(np.where(cut_ac[:, None], e[:, [1, 2]], e[:, [2, 3]]))
+    segments = np.concatenate(segments)
+
+    # every crossing point belongs to two segments, get its two neighbours
+    ends = np.concatenate((segments, segments[:, ::-1]))
+    ends = ends[np.argsort(ends[:, 0], kind='stable')]
+    nodes = ends[::2, 0]
+    neighbours = np.searchsorted(nodes, ends[:, 1]).reshape(-1, 2).tolist()
+
+    # crossing points interpolated on their edges
+    is_v = nodes>=h*(w-1)
+    i = np.where(is_v, (nodes-h*(w-1))//w, nodes//(w-1))
+    j = np.where(is_v, (nodes-h*(w-1))%w, nodes%(w-1))
+    p0, p1 = p[i, j], p[i+is_v, j+~is_v]
+    t = (level-p0)/(p1-p0)
+    points = np.stack((i+is_v*t, j+~is_v*t), axis=-1)-1
+
+    # walk the loops
+    contours = []
+    visited = np.zeros(len(nodes), dtype='bool')
+    for start in range(len(nodes)):
+        if visited[start]: continue
+        loop = [start]
+        visited[start] = True
+        prev, node = start, neighbours[start][0]
+        while node!=start:
+            loop.append(node)
+            visited[node] = True
+            n0, n1 = neighbours[node]
+            prev, node = node, n1 if n0==prev else n0
+        contours.append(points[loop])
+
+    return contours
+
+
+
+def get_foil_xy_from_probability_map(p, level=yellow_threshold, smooth_box=predicted_contour_smooth_box, polyorder=3):
+    '''
+    Create arrays of X and Y foil coordinates for .dat file from network output without thresholding.
+
+    Action:
+    - trace sub-pixel iso-line of probabilities at *level*, the longest closed one is foil;
+    - start it from the tail, go over the top to the nose and back over the bottom;
+    - normalize by chord;
+    - interpolate to n_points_in_predicted_dat points;
+    - smooth Y in one savgol_filter pass with *smooth_box* window (0 to skip), sub-pixel contour has no
+      staircase to hide, so smooth_foil_xy's growing windows are not needed.
+
+    X = [1...0...1] along foil shape, Y = [-1...1]
+
+    Input: 2D float array of foil probabilities.
+    Output: (x, y) arrays.
+    '''
+    contours = trace_iso_contours(p, level)
+    assert len(contours)>0, 'Image is empty'
+    rows, cols = max(contours, key=len).T
+
+    # counterclockwise in (col, -row) is tail - top - nose - bottom
+    if np.sum(cols*np.roll(rows, -1)-np.roll(cols, -1)*rows) > 0:
+        rows, cols = rows[::-1], cols[::-1]
+    tail = cols.argmax()
+    rows, cols = np.roll(rows, -tail), np.roll(cols, -tail)
+
+    # drop coincident points (iso-line through pixel centers) and close the contour
+    keep = np.hypot(np.diff(rows, append=rows[0]), np.diff(cols, append=cols[0])) > 1e-9
+    rows, cols = np.append(rows[keep], rows[0]), np.append(cols[keep], cols[0])
+
+    nose = cols.argmin()
+    chord = cols[0]-cols[nose]
+    foil_x = (cols-cols[nose])/chord
+    foil_y = (rows[nose]-rows)/chord
+
+    # интерполируем в нужное число точек
+    f_x, f_y = interpolate_airfoil(foil_x, foil_y, n_points_in_predicted_dat)
+
+    # сглаживаем
+    if smooth_box: f_y = savgol_filter(f_y, smooth_box, polyorder)
+
+    return f_x, f_y
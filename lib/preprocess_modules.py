@@ -8,7 +8,12 @@ from xfoil import XFoil
 from xfoil.model import Airfoil
 from config import *
 from lib.utils import *
+from lib.xfoil_pool import sweep_units, serial_sweep_units
+from lib.polar_cache import polar_cache, polar_fail_cache, put_to_cache, get_polar_cache_key, get_polar_fail_cache_key
+from multiprocessing import Array, Pool
+import os
 from scipy.signal import savgol_filter
+from functools import lru_cache
 
 
 
@@ -40,7 +45,41 @@ def show_foil_info(fpath, param_to_show='Cl'):
 
 
 
+# bump to recalculate alfa steps persisted in alfa_step_cache_file
+ALFA_STEP_CACHE_VERSION = 1
+
+# alfa steps calculated or loaded in this process
+_alfa_steps = {}
+
+
+
 def get_alfa_step(alfa_min, alfa_max, n_points_alfa):
+    '''
+    Returns proper alfa_step for xf.aseq and list of alfas, see calc_alfa_step.
+    Result is calculated once per (alfa_min, alfa_max, n_points_alfa) and persisted in alfa_step_cache_file.
+    '''
+    key = (ALFA_STEP_CACHE_VERSION, alfa_min, alfa_max, n_points_alfa)
+
+    if key not in _alfa_steps:
+        try:
+            _alfa_steps.update(load_pkl(alfa_step_cache_file))
+        except Exception:
+            pass
+
+    if key not in _alfa_steps:
+        _alfa_steps[key] = calc_alfa_step(alfa_min, alfa_max, n_points_alfa)
+        try:
+            save_pkl(_alfa_steps, alfa_step_cache_file)
+        except Exception as ex:
+            print("W: Alfa step is not saved to %s: %s" % (alfa_step_cache_file, str(ex)))
+
+    alfa_step, alfas = _alfa_steps[key]
+
+    return alfa_step, alfas.copy()
+
+
+
+def calc_alfa_step(alfa_min, alfa_max, n_points_alfa):
     '''
     Finds and return proper alfa_step for xf.aseq to have exactly n_points_alfa alfas in xfoil predictions.
     '''
@@ -118,6 +157,43 @@ def get_foil_root_thickness(foil):
 
 
 
+def parse_airfoil_dat(text, fname='', silent=False):
+    '''
+    Parses contents of UIUC-style .dat file: name line, then "x y" lines in Selig format
+    (TE -> upper -> LE -> lower -> TE) or Lednicer format (points counts line, upper LE -> TE, lower LE -> TE).
+    Any line endings are accepted, lines which are not a pair of numbers are skipped.
+    Returns x and y arrays of coordinates in Selig order.
+    "silent" == do not show warnings. 
+    '''
+
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').replace('(', '').replace(')', '').split('\n')[1:]
+    pairs = [l for l in (line.split() for line in lines) if len(l)==2]
+
+    try:
+        xy = np.array(pairs, dtype='float64').reshape(-1, 2)
+    except ValueError:
+        # text lines of two words, convert line by line
+        good = []
+        for p in pairs:
+            try:
+                good.append((float(p[0]), float(p[1])))
+            except ValueError:
+                if not silent: print("W: File '%s': can't read and convert X=%s and Y=%s, this coordinate skipped." % (fname, p[0], p[1]))
+        xy = np.array(good, dtype='float64').reshape(-1, 2)
+
+    # Lednicer format: first pair is upper and lower points counts
+    if len(xy)>2 and xy[0, 0]>=2 and xy[0, 1]>=2 and np.all(xy[0]==np.round(xy[0])) and xy[0].sum()==len(xy)-1:
+        n_upper = int(xy[0, 0])
+        upper = xy[1:1+n_upper]
+        lower = xy[1+n_upper:]
+        # skip duplicated LE point
+        if np.array_equal(upper[0], lower[0]): lower = lower[1:]
+        xy = np.vstack((upper[::-1], lower))
+
+    return xy[:, 0].copy(), xy[:, 1].copy()
+
+
+
 def read_airfoil_dat_file(fpath, silent=False):
     '''
     Reads file from absolute path fpath.
@@ -125,46 +201,71 @@ def read_airfoil_dat_file(fpath, silent=False):
     "silent" == do not show warnings. 
     '''
     
-    assert isinstance(fpath, Path,), Exception('Parameter "%s" is not a Path instance' % fpath)
+    assert isinstance(fpath, (Path, str)), Exception('Parameter "%s" is not a Path instance' % fpath)
     
-    file = open(fpath, 'r', newline='\r') 
-    
-    dat = file.read().split('\r')    
-    
-    x=[]
-    y=[]
+    with open(fpath, 'rb') as file:
+        text = file.read().decode('latin-1')
 
-    for i in range(1, len(dat)-1):
-        coords = dat[i].split()
-        skipped_Xs = []
-        if len(coords) == 2:
-            try:
-                x_c = coords[0]
-                y_c = coords[1]                
-                x_c = x_c.replace(")","").replace("(","")
-                y_c = y_c.replace(")","").replace("(","")                
-                try:
-                    assert isinstance(float(x_c), float), str(fpath)
-                    assert isinstance(float(y_c), float), str(fpath)
-                    x.append(x_c)
-                    y.append(y_c)
-                except Exception as ex:
-                    if not silent: print("W: Error in %s:" % (str(fpath) , str(ex)))
-            except:
-                if not silent: print("W: File '%s': can't read and convert X=%s and Y=%s, this coordinate skipped." 
-                      % (str(fpath), str(coords[0]), str(coords[1])))                            
-                skipped_Xs.append(x_c)
-          
-    if len(skipped_Xs)>0:
-        assert (set(skipped_Xs) in x), Exception('E: Some coordinates are not imported in %s' % str(fpath))
-        
-    x = np.array(x).astype('float')
-    y = np.array(y).astype('float')
+    x, y = parse_airfoil_dat(text, str(fpath), silent)
+
+    assert len(x)>0, Exception('E: No coordinates in %s' % str(fpath))
     
     return x, y
 
 
 
+def _read_dat_files(fpaths):
+    '''
+    Reads list of .dat files, returns list of (x, y) or None for unreadable files.
+    '''
+    res = []
+    for fpath in fpaths:
+        try:
+            res.append(read_airfoil_dat_file(fpath, silent=True))
+        except Exception:
+            res.append(None)
+    return res
+
+
+
+def read_airfoil_dat_folder(folder=foils_dat_path, names=None, n_workers=1):
+    '''
+    Bulk mode of read_airfoil_dat_file: parses all .dat files in *folder* (or listed *names*)
+    into one packed array.
+
+    n_workers: parse in a pool of processes if >1.
+
+    Returns (names, coords, offsets): list of parsed file names, (n_points_total, 2) array of x, y
+    and offsets array, foil i coords are coords[offsets[i]:offsets[i+1]].
+    '''
+    if names is None: names = sorted(f for f in os.listdir(folder) if f.endswith('.dat'))
+    fpaths = [Path(folder, f) for f in names]
+
+    if n_workers>1:
+        chunks = [fpaths[i::n_workers] for i in range(n_workers)]
+        with Pool(n_workers) as pool:
+            parsed_chunks = pool.map(_read_dat_files, chunks)
+        parsed = [None]*len(fpaths)
+        for i, chunk in enumerate(parsed_chunks):
+            parsed[i::n_workers] = chunk
+    else:
+        parsed = _read_dat_files(fpaths)
+
+    names = [n for n, p in zip(names, parsed) if p is not None]
+    parsed = [p for p in parsed if p is not None]
+
+    offsets = np.zeros(len(parsed)+1, dtype='int64')
+    offsets[1:] = np.cumsum([len(p[0]) for p in parsed])
+
+    coords = np.empty((offsets[-1], 2), dtype='float64')
+    for i, (x, y) in enumerate(parsed):
+        coords[offsets[i]:offsets[i+1], 0] = x
+        coords[offsets[i]:offsets[i+1], 1] = y
+
+    return names, coords, offsets
+
+
+
 def interpolate_airfoil(x, y, n_foil_points=128):
     '''
     Gets foil X and Y as numpy arrays of m points each.
@@ -195,41 +296,75 @@ def fill_gaps_in_xfoil_curve(curve, deg=3):
     assert isinstance(curve, np.ndarray), "The curve is not an array"
     assert len(curve)>0, "The curve lenght is 0!"
     
-    res_curve = curve.copy()
-    
-    x = np.arange(len(res_curve))
-    has_values = ~np.isnan(res_curve)
-    has_nans = np.isnan(res_curve)
-    
-    try:
-        points = np.polyfit(x[has_values], res_curve[has_values], deg=3)
-        res_curve[has_nans]  = np.polyval(points, x[has_nans])
-    except Exception as ex:
-        print(ex)
-        print("x:", x)
-        print("res_curve", res_curve)
-    
-    return res_curve
+    return fill_gaps_in_xfoil_curves(curve[None, :], deg=deg)[0]
+
+
+
+def fill_gaps_in_xfoil_curves(curves, deg=3):
+    '''
+    Batched fill_gaps_in_xfoil_curve for 2D array of curves (n_curves, n_points).
+    NaNs are filled with polynomial of *deg* fitted to the curve's values, all curves are fitted
+    at once as weighted least squares on shared Vandermonde basis with NaN mask as weights.
+    Gives the same result as np.polyfit per curve. Curves with *deg* values or less are returned as is
+    with their NaNs: polynomial is not defined by them, so no fill is better than arbitrary minimum-norm one.
+    Returns array of the same shape.
+    '''
+    assert isinstance(curves, np.ndarray), "Curves are not an array"
+    assert len(curves.shape)==2, "Curves are not a 2D array"
+
+    res_curves = curves.copy()
+
+    has_nans = np.isnan(curves)
+    weights = (~has_nans).astype('float64')
+    n_values = weights.sum(axis=1)
+
+    # curves with gaps and with enough values to fit
+    to_fill = has_nans.any(axis=1) & (n_values>deg)
+    if not to_fill.any(): return res_curves
+
+    weights = weights[to_fill]
+    n_values = n_values[to_fill]
+
+    # shared basis, masked per curve: (n_curves, n_points, deg+1)
+    basis = np.vander(np.arange(curves.shape[1], dtype='float64'), deg+1)
+    lhs = weights[:, :, None]*basis[None, :, :]
+    rhs = np.where(has_nans[to_fill], 0., curves[to_fill])
+
+    # scale columns like np.polyfit does
+    scale = np.sqrt((lhs*lhs).sum(axis=1))
+    scale[scale==0] = 1.
+    lhs /= scale[:, None, :]
+
+    # least squares solution for all curves with one pinv call
+    coefs = (np.linalg.pinv(lhs, rcond=n_values*np.finfo('float64').eps) @ rhs[:, :, None])[:, :, 0]/scale
+
+    filled = coefs @ basis.T
+    res_curves[to_fill] = np.where(has_nans[to_fill], filled, curves[to_fill])
+
+    return res_curves
+
 
 
-def create_foil_array_from_dat_file(fname, Re, alfas, alfa_min, alfa_max, alfa_step):
+def prepare_foil_geometry(fname, coords=None):
+    '''
+    Reads foil from .dat file *fname*, interpolates it to n_foil_points and gets its thicknesses.
+    Returns dict with raw coords, xfoil Airfoil() object and thicknesses.
     
-    # set up result dictionary
-    foil_output = {}
+    coords: raw coords (x, y) already parsed from .dat file, file is not read then.
+    '''
 
-    # set up foil data array
-    foil_array = np.zeros((n_foil_params, n_points_Re, n_points_alfa))
-    pre_foil_array = np.zeros((n_foil_params, n_points_Re, n_points_alfa))
+    # set up result dictionary
+    geometry = {}
 
     # load foil coords from file
     try:
-        x, y = read_airfoil_dat_file(fname)
+        x, y = coords if coords is not None else read_airfoil_dat_file(fname)
     except:
         raise Exception("W: Foil %s failed to read from file, skipped." % (fname))
         
     # keep in output dict
-    foil_output['x_raw'] = x
-    foil_output['y_raw'] = y
+    geometry['x_raw'] = x
+    geometry['y_raw'] = y
 
     # convert coords to n_foil_points
     try:
@@ -238,40 +373,146 @@ def create_foil_array_from_dat_file(fname, Re, alfas, alfa_min, alfa_max, alfa_s
         raise Exception("W: Foil %s failed to interpolate to %i points, skipped." % (fname, n_foil_points))        
 
     # set an Airfoil object on these coords
-    current_foil = Airfoil(x,y)
+    geometry['y'] = Airfoil(x,y)
 
     # get root and flap thicknesses 
     try:
-        d = get_foil_flap_thickness(current_foil)
-        S = get_foil_root_thickness(current_foil) 
+        geometry['d'] = get_foil_flap_thickness(geometry['y'])
+        geometry['S'] = get_foil_root_thickness(geometry['y']) 
     except:
         raise Exception("W: Foil %s failed to get thicknesses, skipped." % (fname))             
 
+    return geometry
+
+
+
+class HopelessFoilError(Exception):
+    '''
+    Foil polars can not be completed with current XFoil settings. Such foils are kept in negative cache.
+    '''
+    pass
+
+
+
+def get_foil_abort_reason(sweeps, n_sweeps, deg=3):
+    '''
+    Early-exit policy for XFoil sweeps of one foil.
+    Takes (a, cl, cd, cm, cp) results of Re sweeps done so far and total number of sweeps.
+
+    assemble_foil_output fills sweeps with less than max_nans_in_curve NaNs in alfa plane, other sweeps keep
+    only their converged points, then every alfa column is filled in Re plane if it has more than *deg* values
+    (see fill_gaps_in_xfoil_curves). Foil is hopeless only when some alfa column can not get enough values
+    even if all remaining sweeps converge.
+    Returns reason string for hopeless foil or None.
+    '''
+    if not sweeps: return None
+
+    known = np.zeros(len(sweeps[0][0]))
+    for res in sweeps:
+        nans = np.isnan(np.array(res, dtype='float64')).any(axis=0)
+        known += 1 if np.mean(np.isnan(res[0])) < max_nans_in_curve else ~nans
+
+    needed = min(deg+1, n_sweeps)
+    reachable = known+n_sweeps-len(sweeps)
+
+    if reachable.min() < needed:
+        column = int(reachable.argmin())
+        return "W: Foil skipped - alfa point %i can have only %i of %i Re values needed to fill it." % (column, reachable[column], needed)
+
+    return None
+
+
+
+def collect_foil_sweeps(units, n_foils, n_sweeps, cancelled, early_abort=xfoil_early_abort, on_sweep=None):
+    '''
+    Groups (foil index, Re index, result) units of sweep_units or serial_sweep_units by foil and applies
+    early abort policy of get_foil_abort_reason. Shared by run_xfoil_sweeps and build_foil_polars.
+
+    cancelled: flags per foil shared with units runner, hopeless foils are flagged so their remaining units are skipped.
+    on_sweep: optional callback(foil index, Re index) called after every finished sweep.
+
+    Yields (foil index, list of results per Re) once all Re's of foil are done,
+    or (foil index, HopelessFoilError) as soon as foil is found hopeless.
+    '''
+    pending = [{} for _ in range(n_foils)]
+    n_done = [0]*n_foils
+
+    for foil_idx, re_idx, res in units:
+        n_done[foil_idx] += 1
+        if cancelled[foil_idx]: continue
+
+        pending[foil_idx][re_idx] = res
+        if on_sweep: on_sweep(foil_idx, re_idx)
+
+        reason = get_foil_abort_reason(list(pending[foil_idx].values()), n_sweeps) if early_abort else None
+        if reason:
+            # stop hopeless foil, runners skip its queued units
+            cancelled[foil_idx] = 1
+            pending[foil_idx] = None
+            yield foil_idx, HopelessFoilError(reason)
+
+        elif n_done[foil_idx]==n_sweeps:
+            yield foil_idx, [pending[foil_idx][r] for r in range(n_sweeps)]
+            pending[foil_idx] = None
+
+
+
+def run_xfoil_sweeps(foils, Re, alfa_min, alfa_max, alfa_step, xf=None, n_workers=1, early_abort=xfoil_early_abort, on_sweep=None):
+    '''
+    Runs xf.aseq for every foil from *foils* list of Airfoil() objects at every Re.
+    Returns list (per foil) of lists (per Re) of (a, cl, cd, cm, cp) tuples,
+    aborted foils get HopelessFoilError instance instead of the list.
+    
+    xf: XFoil() instance to reuse in serial mode, a new one is created if None.
+    n_workers: if >1, (foil, Re) units are run in a pool of processes with work stealing.
+    early_abort: stop foil's sweeps as soon as get_foil_abort_reason finds it hopeless.
+    on_sweep: optional callback(foil index, Re index) called after every finished sweep.
+    '''
+    
+    if n_workers>1:
+        cancelled = Array('b', len(foils))
+        units = sweep_units(foils, Re, alfa_min, alfa_max, alfa_step, n_workers, cancelled=cancelled)
+    else:
+        cancelled = [0]*len(foils)
+        units = serial_sweep_units(foils, Re, alfa_min, alfa_max, alfa_step, xf=xf, cancelled=cancelled)
+
+    sweeps = [None]*len(foils)
+    for foil_idx, res in collect_foil_sweeps(units, len(foils), len(Re), cancelled, early_abort, on_sweep):
+        sweeps[foil_idx] = res
+
+    return sweeps
+
+
+
+def assemble_foil_output(geometry, sweeps, Re, alfas):
+    '''
+    Puts XFoil results of one foil (list of (a, cl, cd, cm, cp) per Re) together
+    into foil array (n_foil_params, n_points_Re, n_points_alfa) and fills its gaps.
+    Returns foil output dict, raises if gaps can not be filled.
+    '''
+
+    # set up result dictionary
+    foil_output = {'x_raw': geometry['x_raw'], 'y_raw': geometry['y_raw']}
+
+    # set up foil data array
+    foil_array = np.zeros((n_foil_params, n_points_Re, n_points_alfa))
+    pre_foil_array = np.zeros((n_foil_params, n_points_Re, n_points_alfa))
+
     # store in ary
-    foil_array[4, :, :] = d
-    foil_array[5, :, :] = S    
+    foil_array[4, :, :] = geometry['d']
+    foil_array[5, :, :] = geometry['S']
 
-    # setup xfoil lib
-    xf = XFoil()
-    xf.airfoil = current_foil
-    xf.max_iter = xfoil_max_iterations
+    # collect XFoil results for each Re
+    fill_alfa = np.zeros(len(Re), dtype='bool')
 
-    # xfoiling for each Re
     for num in range(len(Re)):
 
-        xf.Re = Re[num]        
-        a, cl, cd, cm, cp = xf.aseq(alfa_min, alfa_max, alfa_step)  
+        a, cl, cd, cm, cp = sweeps[num]
 
         assert (len(a)==n_points_alfa), "Lenght of alfa array is wrong!"
 
         nans_percent = sum(np.isnan(a))/len(a)
-
-        # interpolate gaps in alfa plane
-        if nans_percent < max_nans_in_curve:            
-            cl = fill_gaps_in_xfoil_curve(cl)
-            cd = fill_gaps_in_xfoil_curve(cd)
-            cm = fill_gaps_in_xfoil_curve(cm)
-            cp = fill_gaps_in_xfoil_curve(cp)
+        fill_alfa[num] = nans_percent < max_nans_in_curve
 
         # write results to main array
         foil_array[0, num, :] = cl
@@ -281,20 +522,16 @@ def create_foil_array_from_dat_file(fname, Re, alfas, alfa_min, alfa_max, alfa_s
         foil_array[6, num, :] = Re[num]
         foil_array[7, num, :] = alfas
 
-        # write results to debug array
-        pre_foil_array[0, num, :] = cl
-        pre_foil_array[1, num, :] = cd
-        pre_foil_array[2, num, :] = cm
-        pre_foil_array[3, num, :] = cp
-        pre_foil_array[6, num, :] = Re[num]
-        pre_foil_array[7, num, :] = alfas
-
-        # interpolate gaps in Re plane
-        for alfa in range(len(alfas)):
-            foil_array[0, :, alfa] = fill_gaps_in_xfoil_curve(foil_array[0, :, alfa])
-            foil_array[1, :, alfa] = fill_gaps_in_xfoil_curve(foil_array[1, :, alfa])
-            foil_array[2, :, alfa] = fill_gaps_in_xfoil_curve(foil_array[2, :, alfa])
-            foil_array[3, :, alfa] = fill_gaps_in_xfoil_curve(foil_array[3, :, alfa])            
+    # interpolate gaps in alfa plane for all Re's with enough values at once
+    curves = foil_array[:4, fill_alfa].reshape(-1, n_points_alfa)
+    foil_array[:4, fill_alfa] = fill_gaps_in_xfoil_curves(curves).reshape(4, -1, n_points_alfa)
+
+    # write results to debug array
+    pre_foil_array[[0, 1, 2, 3, 6, 7]] = foil_array[[0, 1, 2, 3, 6, 7]]
+
+    # interpolate gaps in Re plane once over the whole grid: (4, Re, alfa) -> (4*alfa, Re) curves
+    curves = foil_array[:4].transpose(0, 2, 1).reshape(-1, len(Re))
+    foil_array[:4] = fill_gaps_in_xfoil_curves(curves).reshape(4, -1, len(Re)).transpose(0, 2, 1)
 
     # save or discard data
     if np.sum(np.isnan(foil_array))==0:
@@ -302,13 +539,13 @@ def create_foil_array_from_dat_file(fname, Re, alfas, alfa_min, alfa_max, alfa_s
         # fill output dict
         foil_output['X'] = foil_array
         foil_output['X_raw'] = pre_foil_array
-        foil_output['y'] = current_foil
-        foil_output['d'] = d
-        foil_output['S'] = S
+        foil_output['y'] = geometry['y']
+        foil_output['d'] = geometry['d']
+        foil_output['S'] = geometry['S']
 
     else:
         
-        raise Exception("W: Foil skipped - %i NaNs in foil_array." % int(np.sum(np.isnan(foil_array))))
+        raise HopelessFoilError("W: Foil skipped - %i NaNs in foil_array." % int(np.sum(np.isnan(foil_array))))
         
     print("     --> %i NaNs corrected." % (int(np.sum(np.isnan(pre_foil_array)))))
         
@@ -316,6 +553,94 @@ def create_foil_array_from_dat_file(fname, Re, alfas, alfa_min, alfa_max, alfa_s
 
 
 
+def create_foil_array_from_dat_file(fname, Re, alfas, alfa_min, alfa_max, alfa_step, xf=None, n_workers=1, cache=polar_cache, fail_cache=polar_fail_cache, on_sweep=None, coords=None):
+    '''
+    Runs XFoil over all Re's for foil from .dat file *fname* and returns dict with foil data.
+    
+    xf: XFoil() instance to reuse (e.g. one per worker process), a new one is created if None.
+    n_workers: split foil into (foil, Re) units and run them in *n_workers* processes.
+    cache: polars cache keyed by foil geometry and XFoil settings, None to always recalculate.
+    fail_cache: negative cache with reasons of hopeless foils, None to always recalculate.
+    on_sweep: optional callback(foil index, Re index) called after every finished XFoil sweep.
+    coords: raw coords (x, y) already parsed from .dat file, file is not read then.
+    '''
+    
+    geometry = prepare_foil_geometry(fname, coords)
+    key = get_polar_cache_key(geometry['y'], Re)
+    fail_key = get_polar_fail_cache_key(geometry['y'], Re)
+
+    # same geometry with same settings is already calculated
+    if cache is not None:
+        foil_output = cache.get(key)
+        if foil_output is not None:
+            print("     --> Polars found in cache.")
+            foil_output['x_raw'] = geometry['x_raw']
+            foil_output['y_raw'] = geometry['y_raw']
+            return foil_output
+
+    # or known to fail
+    if fail_cache is not None:
+        reason = fail_cache.get(fail_key)
+        if reason is not None: raise HopelessFoilError(reason)
+
+    try:
+        # xfoiling for each Re
+        sweeps = run_xfoil_sweeps([geometry['y']], Re, alfa_min, alfa_max, alfa_step, xf=xf, n_workers=n_workers, on_sweep=on_sweep)[0]
+        if isinstance(sweeps, HopelessFoilError): raise sweeps
+
+        foil_output = assemble_foil_output(geometry, sweeps, Re, alfas)
+
+    except HopelessFoilError as ex:
+        put_to_cache(fail_cache, fail_key, str(ex))
+        raise
+
+    put_to_cache(cache, key, foil_output)
+
+    return foil_output
+
+
+
+
+@lru_cache(maxsize=32)
+def get_smoothing_operator(n_points, min_box=5, max_box=101, box_increase_power=1.5, polyorder=3, n_runs=1):
+    '''
+    Returns read-only (n_points, n_points) matrix S of smooth_foil_xy passes: smoothed y == S @ y.
+    
+    Every savgol_filter pass is linear, so coefficients of each window size in the boxes schedule
+    are computed once and the passes from the nose outward are chained on identity matrix.
+    Matrices are cached per configuration.
+    '''
+    mid_point = n_points//2
+    
+    xs = np.linspace(0, 1, mid_point)
+    boxes = ((np.power(xs, 1/box_increase_power)*(max_box-min_box)+min_box).astype('int'))//2*2+1 # array of box sizes
+    
+    # filter matrices: savgol_filter of unit vectors, slices as long as the box are fitted by one polynomial
+    kernels = {box: savgol_filter(np.eye(box), box, polyorder, axis=0) for box in np.unique(boxes).tolist()}
+    nose = slice((mid_point-min_box//2)-3, (mid_point+min_box//2)+3)
+    
+    S = np.eye(n_points)
+    nose_kernel = savgol_filter(np.eye(len(S[nose])), min_box, polyorder=polyorder, axis=0)
+    
+    for run in range(n_runs):
+        
+        # nose filtering
+        S[nose] = nose_kernel @ S[nose]
+        
+        # all points filtering
+        for i, box_size in enumerate(boxes.tolist()):
+            ind_p = mid_point+i
+            ind_n = mid_point-i
+            if not ind_p+box_size>n_points:
+                S[ind_p:ind_p+box_size] = kernels[box_size] @ S[ind_p:ind_p+box_size]
+                
+            if not ind_n-box_size<0:
+                S[ind_n-box_size:ind_n] = kernels[box_size] @ S[ind_n-box_size:ind_n]
+    
+    S.setflags(write=False)
+    return S
+
+
 
 def smooth_foil_xy(x, y, min_box=5, max_box=101, box_increase_power=1.5, polyorder=3, n_runs=1):
     
@@ -333,6 +658,8 @@ def smooth_foil_xy(x, y, min_box=5, max_box=101, box_increase_power=1.5, polyord
     Outputs:
     - smoothed X and Y arrays.
     
+    Savitzky-Golay passes with growing boxes from the nose outward are applied as one
+    precomputed matrix, see get_smoothing_operator.
     '''
     assert isinstance(x, np.ndarray), 'X is not an Numpy array'
     assert len(x.shape)==1, 'X is not an 1D array'
@@ -342,34 +669,9 @@ def smooth_foil_xy(x, y, min_box=5, max_box=101, box_increase_power=1.5, polyord
     assert min_box%2!=0, 'Min_box shall be odd'
     assert polyorder<min_box, 'Polyorder shall be less than min_box'
     
-    x=x.copy()
-    y=y.copy()
-   
-    x_points = x.shape[0] 
-    mid_point = x_points//2
-    
-    box_increase_power=1/box_increase_power
-    
-    xs = np.linspace(0, 1, mid_point)
-    boxes = ((np.power(xs, box_increase_power)*(max_box-min_box)+min_box).astype('int'))//2*2+1 # array of box sizes
-    
-    for run in range(n_runs):
-              
-        # nose filtering
-        y[(mid_point-min_box//2)-3:(mid_point+min_box//2)+3] = savgol_filter(y[(mid_point-min_box//2)-3:(mid_point+min_box//2)+3], min_box, polyorder=polyorder)
-
-        # all points filtering
-        for i, box_size in enumerate(boxes):
-            ind_p = mid_point+i
-            ind_n = mid_point-i
-            if not ind_p+box_size>x_points:                
-                    y[ind_p:ind_p+box_size] = savgol_filter(y[ind_p:ind_p+box_size], box_size, polyorder)                
-
-            if not ind_n-box_size<0:
-                y[ind_n-box_size:ind_n] = savgol_filter(y[ind_n-box_size:ind_n], box_size, polyorder)
-                
+    S = get_smoothing_operator(y.shape[0], min_box, max_box, box_increase_power, polyorder, n_runs)
             
-    return x, y
+    return x.copy(), S @ y
 
     
 
@@ -0,0 +1,213 @@
+from pathlib import Path
+import argparse
+import os
+import re
+import time
+import numpy as np
+from config import *
+from lib.utils import *
+from lib.cst import get_airfoils_coords
+from lib.raster import foil_bitmaps
+from lib.preprocess_modules import interpolate_airfoil, prepare_foil_geometry
+from lib.polar_builder import build_foil_polars
+from lib.polar_store import PolarStore
+
+
+
+def sample_cst_coefs(n_foils, rng, n_cst=synthetic_n_cst, upper=synthetic_cst_upper, lower=synthetic_cst_lower, jitter=synthetic_cst_jitter):
+    '''
+    Samples A coefs of *n_foils* foils: mean level of every surface is uniform in *upper* / *lower* range,
+    coefs are spread around it with *jitter* std.
+    Returns Au, Al arrays (n_foils, n_cst).
+    '''
+    Au = rng.uniform(*upper, size=(n_foils, 1)) + rng.normal(0, jitter, size=(n_foils, n_cst))
+    Al = rng.uniform(*lower, size=(n_foils, 1)) + rng.normal(0, jitter, size=(n_foils, n_cst))
+    return Au, Al
+
+
+
+def deform_coefs(A, rng, max_depth=synthetic_deform_depth):
+    '''
+    Applies one deform() with random position, width, depth and direction to every row of A coefs.
+    Deformation is a multiplier of coefs, multipliers of distinct deform() parameters are computed once.
+    Returns deformed copy of A.
+    '''
+    n_foils, n_cst = A.shape
+
+    # integer percents as in deform(), width covers at least one coef on each side
+    params = np.stack((rng.integers(0, 101, n_foils),
+                       rng.integers(int(np.ceil(50/n_cst)), 41, n_foils),
+                       rng.integers(1, max_depth+1, n_foils),
+                       rng.integers(0, 2, n_foils)), axis=1)
+
+    multipliers = {}
+    for p in set(map(tuple, params.tolist())):
+        try:
+            multipliers[p] = deform(np.ones(n_cst), *p[:3], positive=bool(p[3]))
+        except Exception:
+            multipliers[p] = np.ones(n_cst)
+
+    return A*np.array([multipliers[p] for p in map(tuple, params.tolist())])
+
+
+
+def get_root_thickness(z):
+    '''
+    Batched get_foil_root_thickness for z coords (n_foils, n_points) on get_airfoils_coords grid,
+    where point k of lower surface and point n_points-1-k of upper surface have the same x.
+    Returns max thickness and min thickness away from nose and tail (negative for crossed surfaces) of every foil.
+    '''
+    n = z.shape[1]//2
+    t = z[:, ::-1][:, :n] - z[:, :n]
+    return t.max(axis=1), t[:, 1:-1].min(axis=1)
+
+
+
+def write_dat(fpath, x, z):
+    '''
+    Saves foil coords in Selig format .dat file with 7 decimals, name line is the file name.
+    '''
+    with open(fpath, 'w') as f:
+        f.write(Path(fpath).stem+'\n')
+        f.write(''.join('%.7f %.7f\n' % (xi, zi) for xi, zi in zip(x, z)))
+
+
+
+def get_saved_thickness(x, z):
+    '''
+    Returns root thickness S of foil coords as they are saved by write_dat and read by XFoil pipeline
+    (rounded, interpolated to n_foil_points by prepare_foil_geometry), None if the geometry is not usable.
+    '''
+    try:
+        return prepare_foil_geometry('synthetic', coords=(np.round(x, 7), np.round(z, 7)))['S']
+    except Exception:
+        return None
+
+
+
+def rasterize_synthetic_foil(name, pkl_path=synthetic_pkl_path, bmp_path=foils_bmp_path):
+    '''
+    Saves target bitmaps of foil *name* from its pkl file to *bmp_path* resolution folders like foils DB bitmaps.
+    '''
+    foil = load_pkl(Path(pkl_path, name+'.pkl'))
+    x, y = interpolate_airfoil(foil['x_raw'], foil['y_raw'], n_points_interpolate_for_bmp)
+    for (bitmap_pixels_y, bitmap_pixels_x), foil_bmp in foil_bitmaps(x, y).items():
+        save_pkl(foil_bmp, Path(bmp_path, str(bitmap_pixels_y)+'x'+str(bitmap_pixels_x), name+'.pkl'))
+
+
+
+def finish_synthetic_foils(names, store, n_cores=synthetic_n_cores, dat_path=synthetic_dat_path, pkl_path=synthetic_pkl_path, bmp_path=foils_bmp_path, niceness=synthetic_niceness):
+    '''
+    Calculates polars of foils *names* from *dat_path* in XFoil pool of *n_cores* processes with priority
+    lowered by *niceness*, puts them into *store* with one write and rasterizes their targets.
+    .dat files of failed foils are removed.
+    Returns list of finished foils names.
+    '''
+    failed = build_foil_polars([Path(dat_path, name+'.dat') for name in names], n_cores, pkl_path=pkl_path, niceness=niceness)
+
+    finished = []
+    for name in names:
+        if name+'.dat' in failed or not Path(pkl_path, name+'.pkl').exists():
+            if Path(dat_path, name+'.dat').exists(): os.remove(Path(dat_path, name+'.dat'))
+            continue
+        finished.append(name)
+
+    # resumed foils may be in the store already
+    store.put_many((name, load_pkl(Path(pkl_path, name+'.pkl'))) for name in finished if name not in store)
+
+    for name in finished: rasterize_synthetic_foil(name, pkl_path, bmp_path)
+
+    return finished
+
+
+
+def generate_synthetic_foils(n_foils, prefix='cst', seed=None, store=None, n_cores=synthetic_n_cores, chunk_size=synthetic_chunk_size,
+                             thickness_range=synthetic_thickness_range, n_coords=synthetic_n_coords, niceness=synthetic_niceness,
+                             max_stalled_chunks=synthetic_max_stalled_chunks, dat_path=synthetic_dat_path, pkl_path=synthetic_pkl_path, bmp_path=foils_bmp_path):
+    '''
+    Grows training data by *n_foils* synthetic foils, chunk by chunk:
+    - samples CST coefs and deforms them with deform() in batch;
+    - generates coords with one matrix multiply (lib.cst) and keeps foils in *thickness_range* root thickness band
+      measured on saved geometry as XFoil pipeline sees it;
+    - saves .dat files to *dat_path* as *prefix*_<number>.dat;
+    - calculates polars in XFoil pool of *n_cores* processes, pkl files go to *pkl_path*, foils are put into *store* by chunks;
+    - rasterizes targets to *bmp_path* resolution folders, so build_dataset picks them up from the store.
+
+    XFoil work is limited to *n_cores* worker processes with priority lowered by *niceness*, so the generator can run on shared machines.
+    Every chunk is stored before the next one is generated, interrupted run is finished by the next call:
+    foils with .dat file but without bitmaps are completed first, they do not count toward *n_foils*.
+    Raises if *max_stalled_chunks* chunks in a row give no foil (e.g. thickness band out of reach of CST ranges).
+    Returns list of finished foils names, resumed ones included.
+    '''
+    if store is None: store = PolarStore()
+
+    rng = np.random.default_rng(seed)
+    for folder in [dat_path, pkl_path]+[Path(bmp_path, str(by)+'x'+str(bx)) for by, bx in bitmap_outputs]:
+        os.makedirs(folder, exist_ok=True)
+
+    # numbering continues after existing foils, unfinished foils of interrupted run are completed first
+    numbers = [int(m.group(1)) for m in (re.fullmatch(prefix+r'_(\d+)\.dat', f) for f in os.listdir(dat_path)) if m]
+    next_number = max(numbers, default=-1)+1
+    res = bitmap_outputs[-1]
+    ready = set(os.listdir(Path(bmp_path, str(res[0])+'x'+str(res[1]))))
+    pending = ['%s_%07i' % (prefix, n) for n in sorted(numbers) if '%s_%07i.pkl' % (prefix, n) not in ready]
+
+    resumed = []
+    if pending:
+        print('Finishing %i foils of interrupted run.' % len(pending))
+        resumed = finish_synthetic_foils(pending, store, n_cores, dat_path, pkl_path, bmp_path, niceness)
+
+    made = []
+    stalled = 0
+    start = time.time()
+    while len(made) < n_foils:
+
+        Au, Al = sample_cst_coefs(chunk_size, rng)
+        Au, Al = deform_coefs(Au, rng), deform_coefs(Al, rng)
+        x, z = get_airfoils_coords(Au, Al, n_coords=n_coords)
+
+        # crossed surfaces are dropped on CST grid at once
+        _, min_thickness = get_root_thickness(z)
+
+        # Selig order from TE over upper surface, leading edge point once
+        le = len(x)//2
+        x_dat = np.delete(x, le)[::-1]
+        names = []
+        for foil_z in z[min_thickness>0]:
+            if len(made)+len(names) >= n_foils: break
+
+            # thickness band is checked on the geometry XFoil and dataset get from the saved file
+            z_dat = np.delete(foil_z, le)[::-1]
+            S = get_saved_thickness(x_dat, z_dat)
+            if S is None or not thickness_range[0] <= S <= thickness_range[1]: continue
+
+            name = '%s_%07i' % (prefix, next_number)
+            write_dat(Path(dat_path, name+'.dat'), x_dat, z_dat)
+            names.append(name)
+            next_number += 1
+
+        finished = finish_synthetic_foils(names, store, n_cores, dat_path, pkl_path, bmp_path, niceness)
+        made += finished
+        print('%i/%i synthetic foils ready, %i of %i sampled passed thickness filter, %.1f s.' % (len(made), n_foils, len(names), chunk_size, time.time()-start))
+
+        stalled = 0 if finished else stalled+1
+        if stalled >= max_stalled_chunks:
+            raise Exception('No synthetic foils made in %i chunks in a row, check synthetic_cst_* ranges and synthetic_thickness_range.' % stalled)
+
+    return resumed+made
+
+
+
+if __name__ == "__main__":
+
+    # usage: python -m lib.synthetic 100000 --cores 4 --seed 1
+
+    parser = argparse.ArgumentParser(description='Generate synthetic foils from CST deformations and add them to PolarStore.')
+    parser.add_argument('n_foils', type=int, help='number of foils to add')
+    parser.add_argument('--cores', type=int, default=synthetic_n_cores, help='XFoil worker processes')
+    parser.add_argument('--chunk', type=int, default=synthetic_chunk_size, help='foils sampled per step')
+    parser.add_argument('--seed', type=int, default=None, help='random seed')
+    parser.add_argument('--prefix', default='cst', help='foil names prefix')
+    args = parser.parse_args()
+
+    generate_synthetic_foils(args.n_foils, args.prefix, args.seed, n_cores=args.cores, chunk_size=args.chunk)
@@ -0,0 +1,135 @@
+from multiprocessing import Process, Queue, Value
+from queue import Empty
+import numpy as np
+import os
+import time
+from xfoil import XFoil
+from config import *
+
+
+
+def _sweep_worker(own, queues, results, unclaimed, cancelled, foils, alfa_min, alfa_max, alfa_step, niceness=0):
+    '''
+    Worker process: runs (foil, Re) units with its own XFoil instance.
+    Takes units from its own queue first and steals from other workers' queues when it is empty.
+    '''
+    # lower priority of the worker only, calling process keeps its own
+    if niceness and hasattr(os, 'nice'): os.nice(niceness)
+
+    xf = XFoil()
+    xf.max_iter = xfoil_max_iterations
+    current_foil = None
+
+    # own queue first, then neighbours
+    order = queues[own:] + queues[:own]
+
+    while True:
+
+        unit = None
+        for q in order:
+            try:
+                unit = q.get_nowait()
+                break
+            except Empty:
+                continue
+
+        if unit is None:
+            # queues may look empty while parent's feeder threads are still flushing them
+            with unclaimed.get_lock():
+                if unclaimed.value == 0: break
+            time.sleep(0.01)
+            continue
+
+        with unclaimed.get_lock():
+            unclaimed.value -= 1
+
+        foil_idx, re_idx, re = unit
+
+        # foil is already found hopeless
+        if cancelled is not None and cancelled[foil_idx]:
+            results.put((foil_idx, re_idx, None))
+            continue
+
+        if current_foil != foil_idx:
+            xf.airfoil = foils[foil_idx]
+            current_foil = foil_idx
+
+        # every unit starts from fresh boundary layers, whatever unit ran on this worker before
+        xf.reset_bls()
+        xf.Re = re
+        results.put((foil_idx, re_idx, xf.aseq(alfa_min, alfa_max, alfa_step)))
+
+
+
+def sweep_units(foils, Re, alfa_min, alfa_max, alfa_step, n_workers, cancelled=None, niceness=0):
+    '''
+    Runs XFoil aseq for every (foil, Re) pair in *n_workers* processes with work stealing.
+    Units of one foil are queued to the same worker where possible, idle workers steal the rest.
+    Boundary layers are reset before every unit, so results do not depend on scheduling.
+
+    foils: list of xfoil Airfoil() objects.
+    Re: list of Re's.
+    cancelled: optional multiprocessing Array of flags per foil, units of flagged foils are skipped.
+    niceness: priority decrease of worker processes (os.nice, ignored where not available).
+
+    Yields (foil index, Re index, (a, cl, cd, cm, cp)) in order of completion, None instead of results for skipped units.
+    '''
+    assert n_workers>0, "n_workers shall be positive"
+
+    units = [(f, r, Re[r]) for f in range(len(foils)) for r in range(len(Re))]
+    if not units: return
+    n_workers = min(n_workers, len(units))
+
+    # contiguous blocks keep foil's units together on one worker
+    queues = [Queue() for _ in range(n_workers)]
+    for q, block in zip(queues, np.array_split(np.arange(len(units)), n_workers)):
+        for i in block: q.put(units[i])
+
+    results = Queue()
+    unclaimed = Value('i', len(units))
+
+    workers = [Process(target=_sweep_worker, args=(w, queues, results, unclaimed, cancelled, foils, alfa_min, alfa_max, alfa_step, niceness), daemon=True)
+               for w in range(n_workers)]
+    for w in workers: w.start()
+
+    try:
+        done = 0
+        while done < len(units):
+            try:
+                res = results.get(timeout=1)
+            except Empty:
+                if any(w.exitcode not in (None, 0) for w in workers):
+                    raise Exception("XFoil worker died, %i of %i units lost." % (len(units)-done, len(units)))
+                continue
+            done += 1
+            yield res
+    finally:
+        for w in workers:
+            if w.is_alive(): w.terminate()
+            w.join()
+
+
+
+def serial_sweep_units(foils, Re, alfa_min, alfa_max, alfa_step, xf=None, cancelled=None):
+    '''
+    Serial counterpart of sweep_units: runs (foil, Re) units one by one with one XFoil instance in this process.
+
+    xf: XFoil() instance to reuse, a new one is created if None.
+    cancelled: optional flags per foil, units of flagged foils are skipped.
+
+    Yields (foil index, Re index, (a, cl, cd, cm, cp)) like sweep_units, None instead of results for skipped units.
+    '''
+    if xf is None: xf = XFoil()
+    xf.max_iter = xfoil_max_iterations
+
+    for foil_idx, foil in enumerate(foils):
+        xf.airfoil = foil
+        for re_idx in range(len(Re)):
+            if cancelled is not None and cancelled[foil_idx]:
+                yield foil_idx, re_idx, None
+                continue
+
+            # fresh boundary layers like in pool workers, results do not depend on previous sweeps
+            xf.reset_bls()
+            xf.Re = Re[re_idx]
+            yield foil_idx, re_idx, xf.aseq(alfa_min, alfa_max, alfa_step)